@@ -1,16 +1,25 @@
+import argparse
+import csv
 import os
-import pandas as pd
 import sqlite3
+import time
 from datetime import datetime
-from tqdm import tqdm, tqdm_notebook
+from pathlib import Path
+from tqdm import tqdm
 from config import *
-from generate_image import generate_images_batch
+from generate_image import generate_images_batch, get_current_model
+from generation_cache import GenerationCache, make_cache_key, is_cacheable, init_cache_hits_table, record_cache_hit
+from image_dedup import process_batch_hashes
 
-def get_batch_dir():
-    """获取当前批次的目录路径"""
+ARTISTS_FOLDER = "prompts/aritsts_folder"
+PROMPTS_FOLDER = "prompts/prompts_folder"
+
+def get_batch_dir(suffix=None):
+    """获取当前批次的目录路径，suffix用于区分同一秒内创建的多个批次"""
     current_date = datetime.now().strftime("%Y%m%d")
     current_time = datetime.now().strftime("%H%M%S")
-    batch_dir = os.path.join("website", "static", "generate_images", "batch", f"{current_date}-{current_time}")
+    batch_name = f"{current_date}-{current_time}" if suffix is None else f"{current_date}-{current_time}-{suffix}"
+    batch_dir = os.path.join(BATCH_ROOT, batch_name)
     if not os.path.exists(batch_dir):
         os.makedirs(batch_dir)
     return batch_dir
@@ -36,8 +45,29 @@ def init_database(batch_dir):
     ''')
     
     conn.commit()
+    init_stage_timings_table(conn)
     return conn
 
+def init_stage_timings_table(conn):
+    """创建各阶段耗时表，试运行计划据此估算之后批次的耗时"""
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS stage_timings (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        stage TEXT NOT NULL,
+        image_path TEXT,
+        seconds REAL NOT NULL,
+        recorded_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''')
+    conn.commit()
+
+def save_stage_timing(conn, stage, seconds, image_path=None):
+    """记录一个阶段的耗时，image_path为空表示整个批次的阶段（如重复检测），由调用方提交"""
+    conn.execute(
+        'INSERT INTO stage_timings (stage, image_path, seconds) VALUES (?, ?, ?)',
+        (stage, image_path, seconds)
+    )
+
 def list_csv_files(directory):
     """列出指定目录下的所有CSV文件"""
     files = [f for f in os.listdir(directory) if f.endswith('.csv')]
@@ -59,13 +89,10 @@ def select_file(files, folder_name):
             tqdm.write("请输入有效的数字")
 
 def read_csv_content(file_path):
-    """读取CSV文件内容"""
-    # 使用正确的参数读取CSV文件
-    df = pd.read_csv(file_path, header=None, skip_blank_lines=True)
-    # 删除空行和只包含空白字符的行
-    df = df.dropna()
-    df = df[df[0].str.strip().astype(bool)]
-    return df[0].tolist()
+    """读取CSV文件第一列的内容"""
+    # 使用标准库解析，避免为读取一列文本导入pandas；跳过空行和只包含空白字符的行
+    with open(file_path, 'r', newline='', encoding='utf-8-sig') as f:
+        return [row[0] for row in csv.reader(f) if row and row[0].strip()]
 
 def save_generation_record(conn, image_path, artist_file, artist_prompt, prompt_file, prompt_text, combined_prompt):
     """保存图片生成记录到数据库"""
@@ -76,20 +103,48 @@ def save_generation_record(conn, image_path, artist_file, artist_prompt, prompt_
     ''', (image_path, artist_file, artist_prompt, prompt_file, prompt_text, combined_prompt))
     conn.commit()
 
-def generate_and_save_with_record(prompt, artist_file, artist_prompt, prompt_file, prompt_text, conn, batch_dir):
-    """生成图片并保存记录"""
-    # 生成时间戳
-    timestamp = datetime.now().strftime("%H%M%S")
-    
-    # 生成图片
-    images = generate_images_batch([prompt], verbose=False)
-    
-    # 生成文件名
-    image_filename = f"image_{timestamp}_0.{IMAGE_SAVE_FORMAT}"
+def get_unique_image_filename(batch_dir, timestamp):
+    """生成批次内不重复的图片文件名，同一秒内的多张图片使用递增序号区分"""
+    index = 0
+    while True:
+        image_filename = FILENAME_TEMPLATE.format(timestamp=timestamp, index=index, format=IMAGE_SAVE_FORMAT)
+        if not os.path.exists(os.path.join(batch_dir, image_filename)):
+            return image_filename
+        index += 1
+
+def generate_and_save_with_record(prompt, artist_file, artist_prompt, prompt_file, prompt_text, conn, batch_dir,
+                                  cache=None, model=None, seed=DEFAULT_SEED, api_client=None, image_filename=None):
+    """生成图片并保存记录，使用固定种子时优先复用生成缓存中的图片"""
+    # 生成文件名（并发生成时由调用方指定，避免多个线程取到同一个文件名）
+    if image_filename is None:
+        timestamp = datetime.now().strftime("%H%M%S")
+        image_filename = get_unique_image_filename(batch_dir, timestamp)
     image_path = os.path.join(batch_dir, image_filename)
     
-    # 保存图片
-    images[0].save(image_path, format=IMAGE_SAVE_FORMAT, quality=IMAGE_QUALITY)
+    cache_key = None
+    entry = None
+    # 模型未知时缓存键无法区分不同模型，不使用缓存
+    if cache is not None and model and is_cacheable(seed):
+        cache_key = make_cache_key(prompt, seed=seed, model=model)
+        entry = cache.lookup(cache_key)
+    
+    start = time.perf_counter()
+    if entry is not None:
+        # 复用之前批次中相同参数的图片
+        cache.reuse(entry, batch_dir, image_filename)
+        save_stage_timing(conn, 'cache', time.perf_counter() - start, image_filename)
+        record_cache_hit(conn, image_filename, os.path.basename(entry[0]), entry[1])
+    else:
+        # 生成图片
+        images = generate_images_batch([prompt], verbose=False, seed=seed, api_client=api_client)
+        generated = time.perf_counter()
+        
+        # 保存图片
+        images[0].save(image_path, format=IMAGE_SAVE_FORMAT, quality=IMAGE_QUALITY)
+        save_stage_timing(conn, 'generate', generated - start, image_filename)
+        save_stage_timing(conn, 'save', time.perf_counter() - generated, image_filename)
+        if cache_key is not None:
+            cache.store(cache_key, batch_dir, image_filename)
     
     # 保存记录到数据库
     save_generation_record(
@@ -102,70 +157,193 @@ def generate_and_save_with_record(prompt, artist_file, artist_prompt, prompt_fil
         prompt
     )
 
-def main():
-    # 定义文件夹路径
-    artists_folder = "prompts/aritsts_folder"
-    prompts_folder = "prompts/prompts_folder"
+def get_batch_status(batch_dir, artist_file=None, prompt_file=None):
+    """
+    读取已有批次的完成情况，只读打开数据库，不会连接WebUI
+    
+    Args:
+        batch_dir (str): 批次目录
+        artist_file (str, optional): 艺术家CSV文件名，默认取数据库中记录最多的文件
+        prompt_file (str, optional): 提示词CSV文件名，默认取数据库中记录最多的文件
     
-    # 列出并选择文件
-    artists_files = list_csv_files(artists_folder)
-    prompts_files = list_csv_files(prompts_folder)
+    Returns:
+        tuple: (artist_file, prompt_file, artists, prompts, done)，done为已生成的(艺术家, 提示词)集合；
+               找不到数据库或CSV文件时返回None
+    """
+    db_path = os.path.join(batch_dir, 'image_generation.db')
+    if not os.path.exists(db_path):
+        tqdm.write(f"错误：找不到数据库 {db_path}")
+        return None
     
-    if not artists_files or not prompts_files:
-        tqdm.write("错误：文件夹中没有找到CSV文件")
+    conn = sqlite3.connect(Path(db_path).resolve().as_uri() + '?mode=ro', uri=True)
+    try:
+        cursor = conn.cursor()
+        cursor.execute('''
+        SELECT artist_file, prompt_file FROM image_records
+        GROUP BY artist_file, prompt_file ORDER BY COUNT(*) DESC LIMIT 1
+        ''')
+        row = cursor.fetchone()
+        cursor.execute('SELECT artist_prompt, prompt_text FROM image_records')
+        done = set(cursor.fetchall())
+    finally:
+        conn.close()
+    
+    if row is not None:
+        artist_file = artist_file or row[0]
+        prompt_file = prompt_file or row[1]
+    if not artist_file or not prompt_file:
+        tqdm.write("错误：批次中还没有记录，请用 --artists 和 --prompts 指定CSV文件")
+        return None
+    
+    artist_path = os.path.join(ARTISTS_FOLDER, artist_file)
+    prompt_path = os.path.join(PROMPTS_FOLDER, prompt_file)
+    for path in (artist_path, prompt_path):
+        if not os.path.exists(path):
+            tqdm.write(f"错误：找不到CSV文件 {path}")
+            return None
+    
+    return artist_file, prompt_file, read_csv_content(artist_path), read_csv_content(prompt_path), done
+
+def print_batch_status(batch_dir, artist_file=None, prompt_file=None):
+    """输出已有批次的完成进度"""
+    status = get_batch_status(batch_dir, artist_file, prompt_file)
+    if status is None:
         return
+    artist_file, prompt_file, artists, prompts, done = status
+    
+    total = len(artists) * len(prompts)
+    finished = sum(1 for artist in artists for prompt in prompts if (artist, prompt) in done)
+    percent = finished / total * 100 if total else 100
+    tqdm.write(f"批次: {os.path.basename(os.path.normpath(batch_dir))}")
+    tqdm.write(f"艺术家文件: {artist_file}（{len(artists)} 个），提示词文件: {prompt_file}（{len(prompts)} 个）")
+    tqdm.write(f"已完成 {finished}/{total} ({percent:.1f}%)，剩余 {total - finished} 张")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='按艺术家×提示词组合批量生成图片')
+    parser.add_argument('--artists', type=str, help='artists文件夹中的CSV文件名，不指定时交互选择')
+    parser.add_argument('--prompts', type=str, help='prompts文件夹中的CSV文件名，不指定时交互选择')
+    parser.add_argument('--dry-run', action='store_true', help='只输出生成计划，不连接WebUI，也不创建批次目录')
+    parser.add_argument('--deadline', type=float, metavar='HOURS', help='试运行时按期望的完成时间（小时）推荐后端数量')
+    parser.add_argument('--status', type=str, metavar='BATCH_DIR', help='查看已有批次的完成进度')
+    parser.add_argument('--resume', type=str, metavar='BATCH_DIR', help='继续生成已有批次中尚未完成的组合')
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
     
-    selected_artist_file = select_file(artists_files, "artists文件夹")
-    selected_prompt_file = select_file(prompts_files, "prompts文件夹")
+    if args.status:
+        print_batch_status(args.status, args.artists, args.prompts)
+        return
     
-    # 读取文件内容
-    artists = read_csv_content(os.path.join(artists_folder, selected_artist_file))
-    prompts = read_csv_content(os.path.join(prompts_folder, selected_prompt_file))
+    if args.resume:
+        # 继续已有批次，跳过已经生成的组合
+        status = get_batch_status(args.resume, args.artists, args.prompts)
+        if status is None:
+            return
+        selected_artist_file, selected_prompt_file, artists, prompts, done = status
+        batch_dir = args.resume
+    else:
+        selected_artist_file = args.artists
+        selected_prompt_file = args.prompts
+        if not selected_artist_file or not selected_prompt_file:
+            # 列出并选择文件
+            artists_files = list_csv_files(ARTISTS_FOLDER)
+            prompts_files = list_csv_files(PROMPTS_FOLDER)
+            
+            if not artists_files or not prompts_files:
+                tqdm.write("错误：文件夹中没有找到CSV文件")
+                return
+            
+            selected_artist_file = selected_artist_file or select_file(artists_files, "artists文件夹")
+            selected_prompt_file = selected_prompt_file or select_file(prompts_files, "prompts文件夹")
+        
+        # 读取文件内容
+        artists = read_csv_content(os.path.join(ARTISTS_FOLDER, selected_artist_file))
+        prompts = read_csv_content(os.path.join(PROMPTS_FOLDER, selected_prompt_file))
+        done = set()
+        batch_dir = None
     
     # 打印读取到的内容数量
     tqdm.write(f"\n从 {selected_artist_file} 中读取到 {len(artists)} 个艺术家风格")
     tqdm.write(f"从 {selected_prompt_file} 中读取到 {len(prompts)} 个提示词")
     
-    # 计算总组合数
-    total_combinations = len(artists) * len(prompts)
+    # 计算待生成的组合
+    pending = [(artist, prompt) for artist in artists for prompt in prompts if (artist, prompt) not in done]
+    total_combinations = len(pending)
+    if done:
+        tqdm.write(f"批次中已有 {len(artists) * len(prompts) - total_combinations} 个组合完成，将跳过")
     tqdm.write(f"\n将生成 {total_combinations} 张图片...")
     
+    if args.dry_run:
+        # 根据历史批次估算耗时与存储，只在试运行时导入
+        from sweep_planner import print_plan
+        print_plan(total_combinations, deadline_hours=args.deadline)
+        return
+    if not total_combinations:
+        return
+    
     # 创建批次目录
-    batch_dir = get_batch_dir()
+    if batch_dir is None:
+        batch_dir = get_batch_dir()
     tqdm.write(f"本次生成的文件将保存在: {batch_dir}")
     
     # 初始化数据库
     conn = init_database(batch_dir)
     
+    # 使用固定种子时启用生成缓存
+    cache = None
+    model = None
+    if is_cacheable(DEFAULT_SEED):
+        model = get_current_model()
+        if model:
+            init_cache_hits_table(conn)
+            cache = GenerationCache()
+            tqdm.write(f"已启用生成缓存 (seed={DEFAULT_SEED}, model={model})")
+        else:
+            # 缓存键包含模型名称，无法确定模型时不能复用其他模型生成的图片
+            tqdm.write("无法获取当前模型，本次运行不使用生成缓存")
+    
     # 使用tqdm创建进度条
     progress_bar = tqdm(total=total_combinations, desc="生成进度")
     
     try:
         # 生成图片并记录信息
-        for artist in artists:
-            for prompt in prompts:
-                combined_prompt = f"{DEFAULT_QUALITY_PROMPT}{artist},{prompt}"
-                generate_and_save_with_record(
-                    combined_prompt,
-                    selected_artist_file,
-                    artist,
-                    selected_prompt_file,
-                    prompt,
-                    conn,
-                    batch_dir
-                )
-                # 更新进度条
-                progress_bar.update(1)
-                # 显示当前正在处理的组合
-                progress_bar.set_postfix_str(f"当前: {artist[:20]}... + {prompt[:20]}...")
+        for artist, prompt in pending:
+            combined_prompt = f"{DEFAULT_QUALITY_PROMPT}{artist},{prompt}"
+            generate_and_save_with_record(
+                combined_prompt,
+                selected_artist_file,
+                artist,
+                selected_prompt_file,
+                prompt,
+                conn,
+                batch_dir,
+                cache=cache,
+                model=model
+            )
+            # 更新进度条
+            progress_bar.update(1)
+            # 显示当前正在处理的组合
+            progress_bar.set_postfix_str(f"当前: {artist[:20]}... + {prompt[:20]}...")
+        progress_bar.close()
+        
+        # 计算感知哈希并检测重复图片
+        tqdm.write("\n正在检测重复图片...")
+        start = time.perf_counter()
+        process_batch_hashes(conn, batch_dir)
+        save_stage_timing(conn, 'dedup', time.perf_counter() - start)
+        conn.commit()
     except Exception as e:
         tqdm.write(f"\n生成过程中出现错误: {str(e)}")
     finally:
         # 关闭进度条
         progress_bar.close()
+        if cache is not None:
+            tqdm.write(cache.summary())
+            cache.close()
         # 关闭数据库连接
         conn.close()
         tqdm.write(f"\n所有图片生成完成，信息已保存到数据库: {os.path.join(batch_dir, 'image_generation.db')}")
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main()
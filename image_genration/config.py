@@ -1,8 +1,14 @@
+import os
+
 # SD WebUI API配置
 # API_HOST = '100.71.15.9'
 # API_PORT = 7860
 API_HOST = 'localhost'
 API_PORT = 6006
+# 任务队列可调度的所有WebUI后端 (host, port)
+API_BACKENDS = [
+    (API_HOST, API_PORT),
+]
 
 # 图片生成配置
 DEFAULT_STEPS = 28
@@ -10,6 +16,7 @@ DEFAULT_CFG_SCALE = 4.5
 DEFAULT_WIDTH = 832
 DEFAULT_HEIGHT = 1216
 DEFAULT_SAMPLER = "Euler"
+DEFAULT_SEED = -1  # -1表示随机种子；使用固定种子时会启用生成缓存
 DEFAULT_NEGATIVE_PROMPT = r"text,watermark,bad anatomy,bad proportions,extra limbs,extra digit,extra legs,extra legs and arms,disfigured,missing arms,too many fingers,fused fingers,missing fingers,unclear eyes,watermark,username,logo,artist logo,patreon logo,weibo logo,arknights logo,"
 DEFAULT_QUALITY_PROMPT = r"very awa,masterpiece,best quality,year 2024,newest,highres,absurdres,"
 
@@ -17,6 +24,28 @@ DEFAULT_QUALITY_PROMPT = r"very awa,masterpiece,best quality,year 2024,newest,hi
 IMAGE_SAVE_FORMAT = "webp"
 IMAGE_QUALITY = 90
 SAVE_DIR = "generate_images"
+BATCH_ROOT = "website/static/generate_images/batch"  # 批次目录的根路径
+
+# 生成缓存配置（仅在使用固定种子时生效）
+GENERATION_CACHE_ENABLED = True
+GENERATION_CACHE_DB = "website/static/generate_images/generation_cache.db"
+
+# 任务队列配置
+JOB_QUEUE_DB = "website/static/generate_images/job_queue.db"
+JOB_QUEUE_HOST = "127.0.0.1"
+JOB_QUEUE_PORT = 8765
+JOB_MAX_ATTEMPTS = 3  # 单元格失败后的最大尝试次数
+JOB_POLL_INTERVAL = 1.0  # 空闲时轮询新任务的间隔（秒）
+BACKEND_RETRY_DELAY = 30  # 后端不可用（连接失败或超时）后暂停调度的时间（秒）
+
+# 试运行计划配置（batch_generate.py --dry-run）
+PLANNER_HISTORY_BATCHES = 20  # 参考最近多少个批次的耗时和文件大小
+PLANNER_DEFAULT_SECONDS_PER_IMAGE = 12.0  # 没有历史记录时每张图片的生成耗时（秒）
+PLANNER_DEFAULT_IMAGE_BYTES = 400 * 1024  # 没有历史记录时每张图片的大小
+PLANNER_DEFAULT_UPLOAD_MBPS = 10.0  # 没有上传基准测试结果时的上传速度（MB/s）
+PLANNER_BENCH_RESULTS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                         "website", "bench_results")  # benchmark.py 的结果目录（与运行目录无关）
+PLANNER_MAX_BACKENDS = 16  # 推荐后端数量的上限
 
 # 文件命名配置
 DATE_FORMAT = "%Y%m%d"
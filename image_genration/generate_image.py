@@ -1,4 +1,4 @@
-import webuiapi
+import threading
 from tqdm import tqdm
 from config import *
 
@@ -9,15 +9,47 @@ def log_info(message):
 def log_error(message):
     tqdm.write(f"错误: {message}")
 
-# 初始化全局API连接
-try:
-    log_info(f"初始化API连接 {API_HOST}:{API_PORT}")
-    api = webuiapi.WebUIApi(host=API_HOST, port=API_PORT)
-except Exception as e:
-    log_error(f"API连接初始化失败: {str(e)}")
-    raise
+def create_api(host=API_HOST, port=API_PORT):
+    """为指定的WebUI后端创建API连接"""
+    # webuiapi 会连带导入 requests 和 PIL，只在真正需要连接时才导入
+    import webuiapi
+    return webuiapi.WebUIApi(host=host, port=port)
 
-def generate_image(prompt, negative_prompt=DEFAULT_NEGATIVE_PROMPT, verbose=True):
+# 全局API连接在第一次使用时才建立，导入本模块不会访问WebUI
+_api = None
+_api_lock = threading.Lock()
+
+def get_api():
+    """获取全局API连接，首次调用时初始化"""
+    global _api
+    if _api is None:
+        with _api_lock:
+            if _api is None:
+                try:
+                    log_info(f"初始化API连接 {API_HOST}:{API_PORT}")
+                    _api = create_api(API_HOST, API_PORT)
+                except Exception as e:
+                    log_error(f"API连接初始化失败: {str(e)}")
+                    raise
+    return _api
+
+def get_current_model(api_client=None):
+    """
+    获取WebUI当前加载的模型名称
+    
+    Args:
+        api_client (webuiapi.WebUIApi, optional): 使用的API连接，默认使用全局连接
+    
+    Returns:
+        str: 模型名称，获取失败时返回None
+    """
+    try:
+        return (api_client or get_api()).util_get_current_model()
+    except Exception as e:
+        log_error(f"获取当前模型失败: {str(e)}")
+        return None
+
+def generate_image(prompt, negative_prompt=DEFAULT_NEGATIVE_PROMPT, verbose=True, seed=DEFAULT_SEED, api_client=None):
     """
     生成图片并返回
     
@@ -25,6 +57,8 @@ def generate_image(prompt, negative_prompt=DEFAULT_NEGATIVE_PROMPT, verbose=True
         prompt (str): 正向提示词
         negative_prompt (str, optional): 负向提示词，默认使用配置文件中的设置
         verbose (bool, optional): 是否显示详细日志，默认为True
+        seed (int, optional): 随机种子，-1表示随机，默认使用配置文件中的设置
+        api_client (webuiapi.WebUIApi, optional): 使用的API连接，默认使用全局连接
     
     Returns:
         PIL.Image: 生成的图片对象
@@ -39,10 +73,10 @@ def generate_image(prompt, negative_prompt=DEFAULT_NEGATIVE_PROMPT, verbose=True
         if verbose:
             log_info(f"开始生成图片，参数: steps={DEFAULT_STEPS}, cfg_scale={DEFAULT_CFG_SCALE}, "
                    f"size={DEFAULT_WIDTH}x{DEFAULT_HEIGHT}, sampler={DEFAULT_SAMPLER}")
-        result = api.txt2img(
+        result = (api_client or get_api()).txt2img(
             prompt=prompt,
             negative_prompt=negative_prompt,
-            seed=-1,  # -1表示随机种子
+            seed=seed,  # -1表示随机种子
             steps=DEFAULT_STEPS,
             cfg_scale=DEFAULT_CFG_SCALE,
             width=DEFAULT_WIDTH,
@@ -58,7 +92,8 @@ def generate_image(prompt, negative_prompt=DEFAULT_NEGATIVE_PROMPT, verbose=True
         log_error(f"生成图片时发生错误: {str(e)}")
         raise
 
-def generate_images_batch(prompts, negative_prompt=DEFAULT_NEGATIVE_PROMPT, verbose=False):
+def generate_images_batch(prompts, negative_prompt=DEFAULT_NEGATIVE_PROMPT, verbose=False, seed=DEFAULT_SEED,
+                          api_client=None):
     """
     批量生成图片
     
@@ -66,6 +101,8 @@ def generate_images_batch(prompts, negative_prompt=DEFAULT_NEGATIVE_PROMPT, verb
         prompts (list): 提示词列表
         negative_prompt (str, optional): 负向提示词，默认使用配置文件中的设置
         verbose (bool, optional): 是否显示详细日志，默认为False
+        seed (int, optional): 随机种子，-1表示随机，默认使用配置文件中的设置
+        api_client (webuiapi.WebUIApi, optional): 使用的API连接，默认使用全局连接
     
     Returns:
         list: 生成的图片对象列表
@@ -77,7 +114,7 @@ def generate_images_batch(prompts, negative_prompt=DEFAULT_NEGATIVE_PROMPT, verb
         if verbose:
             log_info(f"正在生成第 {i}/{len(prompts)} 张图片")
         try:
-            image = generate_image(prompt, negative_prompt, verbose=verbose)
+            image = generate_image(prompt, negative_prompt, verbose=verbose, seed=seed, api_client=api_client)
             results.append(image)
         except Exception as e:
             log_error(f"生成第 {i} 张图片时失败: {str(e)}")
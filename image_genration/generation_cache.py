@@ -0,0 +1,165 @@
+"""
+跨批次的生成结果缓存
+
+以（规范化的完整提示词、反向提示词、种子、步数、CFG、采样器、尺寸、模型）的哈希为键，
+记录每个单元格生成的图片。使用固定种子时，新批次中相同参数的单元格直接复用
+之前任意批次的图片（硬链接到新批次目录），不再调用WebUI。
+
+示例：
+    python generation_cache.py --stats
+    python generation_cache.py --prune
+"""
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+
+from config import *
+
+
+def normalize_prompt(prompt):
+    """规范化提示词：去掉每个标签两侧与内部多余的空白，并去掉空标签"""
+    tags = (' '.join(tag.split()) for tag in prompt.split(','))
+    return ','.join(tag for tag in tags if tag)
+
+
+def make_cache_key(prompt, negative_prompt=DEFAULT_NEGATIVE_PROMPT, seed=DEFAULT_SEED, steps=DEFAULT_STEPS,
+                   cfg_scale=DEFAULT_CFG_SCALE, sampler=DEFAULT_SAMPLER, width=DEFAULT_WIDTH,
+                   height=DEFAULT_HEIGHT, model=None):
+    """根据所有影响生成结果的参数计算缓存键"""
+    payload = {
+        'prompt': normalize_prompt(prompt),
+        'negative_prompt': normalize_prompt(negative_prompt),
+        'seed': int(seed),
+        'steps': int(steps),
+        'cfg_scale': float(cfg_scale),
+        'sampler': sampler,
+        'width': int(width),
+        'height': int(height),
+        'model': model or ''
+    }
+    canonical = json.dumps(payload, sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def is_cacheable(seed):
+    """只有固定种子的结果可以复用"""
+    return GENERATION_CACHE_ENABLED and seed is not None and int(seed) != -1
+
+
+def init_cache_hits_table(conn):
+    """在批次数据库中记录哪些图片来自缓存，上传时可直接在R2中复制原对象"""
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS cache_hits (
+        image_path TEXT PRIMARY KEY,
+        source_batch TEXT NOT NULL,
+        source_image TEXT NOT NULL
+    )
+    ''')
+    conn.commit()
+
+
+def record_cache_hit(conn, image_path, source_batch, source_image):
+    """记录一次缓存复用"""
+    conn.execute('''
+    INSERT OR REPLACE INTO cache_hits (image_path, source_batch, source_image) VALUES (?, ?, ?)
+    ''', (image_path, source_batch, source_image))
+    conn.commit()
+
+
+class GenerationCache:
+    """基于SQLite的生成结果索引"""
+
+    def __init__(self, db_path=GENERATION_CACHE_DB):
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        self.conn = sqlite3.connect(db_path, timeout=30)
+        self.conn.execute('''
+        CREATE TABLE IF NOT EXISTS cache_entries (
+            cache_key TEXT PRIMARY KEY,
+            batch_dir TEXT NOT NULL,
+            image_path TEXT NOT NULL,
+            created_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''')
+        self.conn.commit()
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, cache_key):
+        """查找缓存，返回 (batch_dir, image_path)；源文件已不存在时视为未命中"""
+        row = self.conn.execute(
+            'SELECT batch_dir, image_path FROM cache_entries WHERE cache_key = ?', (cache_key,)
+        ).fetchone()
+        if row is None or not os.path.exists(os.path.join(row[0], row[1])):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return row
+
+    def store(self, cache_key, batch_dir, image_path):
+        """记录新生成的图片"""
+        self.conn.execute('''
+        INSERT OR REPLACE INTO cache_entries (cache_key, batch_dir, image_path) VALUES (?, ?, ?)
+        ''', (cache_key, os.path.abspath(batch_dir), image_path))
+        self.conn.commit()
+
+    @staticmethod
+    def reuse(entry, batch_dir, image_filename):
+        """把缓存的图片放入新批次目录，优先使用硬链接，跨文件系统时退回复制"""
+        source = os.path.join(entry[0], entry[1])
+        target = os.path.join(batch_dir, image_filename)
+        try:
+            os.link(source, target)
+        except OSError:
+            shutil.copy2(source, target)
+        return target
+
+    def summary(self):
+        """本次运行的命中统计"""
+        total = self.hits + self.misses
+        rate = self.hits / total * 100 if total else 0
+        return f"生成缓存: 命中 {self.hits} 次，未命中 {self.misses} 次，命中率 {rate:.1f}%"
+
+    def prune(self):
+        """删除源文件已不存在的缓存条目，返回删除数量"""
+        rows = self.conn.execute('SELECT cache_key, batch_dir, image_path FROM cache_entries').fetchall()
+        stale = [(key,) for key, batch_dir, image_path in rows
+                 if not os.path.exists(os.path.join(batch_dir, image_path))]
+        self.conn.executemany('DELETE FROM cache_entries WHERE cache_key = ?', stale)
+        self.conn.commit()
+        return len(stale)
+
+    def close(self):
+        self.conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='查看或清理生成缓存')
+    parser.add_argument('--db', type=str, default=GENERATION_CACHE_DB, help='缓存数据库路径')
+    parser.add_argument('--stats', action='store_true', help='按批次统计缓存条目')
+    parser.add_argument('--prune', action='store_true', help='删除源文件已不存在的条目')
+    args = parser.parse_args()
+
+    if not os.path.exists(args.db):
+        print(f"缓存数据库不存在: {args.db}")
+        return
+
+    cache = GenerationCache(args.db)
+    try:
+        if args.prune:
+            print(f"已删除 {cache.prune()} 个失效条目")
+        rows = cache.conn.execute('''
+        SELECT batch_dir, COUNT(*), MAX(created_time) FROM cache_entries GROUP BY batch_dir ORDER BY batch_dir
+        ''').fetchall()
+        print(f"共 {sum(row[1] for row in rows)} 个缓存条目，来自 {len(rows)} 个批次")
+        if args.stats:
+            for batch_dir, count, last_time in rows:
+                print(f"  {os.path.basename(batch_dir)}: {count} 条，最近写入 {last_time}")
+    finally:
+        cache.close()
+
+
+if __name__ == '__main__':
+    main()
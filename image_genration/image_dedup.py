@@ -0,0 +1,381 @@
+"""
+生成图片的感知哈希与重复检测
+
+为批次中的每张图片计算 dHash / pHash 以及内容 SHA1，保存到批次数据库，
+再用多索引哈希（把 64 位哈希切成若干段，按鸽巢原理只比较至少一段相同的候选对）
+找出完全相同和近似重复的图片，并报告风格几乎相同的艺术家串。
+
+示例：
+    python image_dedup.py website/static/generate_images/batch/20250102-014551
+    python image_dedup.py <批次目录> --threshold 6 --json duplicates.json
+"""
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+from collections import defaultdict
+from functools import lru_cache
+from itertools import combinations
+
+# 近似重复判定的 pHash 汉明距离阈值
+NEAR_DUPLICATE_THRESHOLD = 4
+# 两个艺术家在共同提示词中重复的比例达到该值时视为风格坍缩
+ARTIST_COLLAPSE_RATIO = 0.75
+# 每次读入内存计算哈希的图片数量
+HASH_CHUNK_SIZE = 512
+
+DHASH_SIZE = 8
+PHASH_SIZE = 32
+PHASH_LOW_FREQ = 8
+
+
+def init_hash_tables(conn):
+    """创建哈希表和重复关系表"""
+    cursor = conn.cursor()
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS image_hashes (
+        image_path TEXT PRIMARY KEY,
+        sha1 TEXT NOT NULL,
+        dhash INTEGER NOT NULL,
+        phash INTEGER NOT NULL
+    )
+    ''')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS image_duplicates (
+        image_path TEXT PRIMARY KEY,
+        duplicate_of TEXT NOT NULL,
+        distance INTEGER NOT NULL,
+        kind TEXT NOT NULL
+    )
+    ''')
+    conn.commit()
+
+
+@lru_cache(maxsize=None)
+def _dct_matrix(n):
+    """n 阶 DCT-II 正交变换矩阵"""
+    import numpy as np
+
+    k = np.arange(n)[:, None]
+    i = np.arange(n)[None, :]
+    matrix = np.sqrt(2.0 / n) * np.cos(np.pi * (2 * i + 1) * k / (2 * n))
+    matrix[0] /= np.sqrt(2.0)
+    return matrix
+
+
+def _bits_to_uint64(bits):
+    """把 (N, 64) 的布尔数组打包为 uint64 数组"""
+    import numpy as np
+
+    packed = np.packbits(bits.reshape(len(bits), 64), axis=1)
+    return packed.view('>u8').ravel().astype(np.uint64)
+
+
+def compute_dhash(gray):
+    """批量计算 dHash，gray 为 (N, 8, 9) 的灰度数组"""
+    return _bits_to_uint64(gray[:, :, 1:] > gray[:, :, :-1])
+
+
+def compute_phash(gray):
+    """批量计算 pHash，gray 为 (N, 32, 32) 的灰度数组"""
+    import numpy as np
+
+    dct = _dct_matrix(PHASH_SIZE)
+    coefficients = dct @ gray @ dct.T
+    low = coefficients[:, :PHASH_LOW_FREQ, :PHASH_LOW_FREQ].reshape(len(gray), -1)
+    # 中位数不含直流分量，避免整体亮度影响结果
+    median = np.median(low[:, 1:], axis=1, keepdims=True)
+    return _bits_to_uint64(low > median)
+
+
+def load_image_arrays(paths):
+    """读取图片并缩放为 dHash / pHash 所需的灰度数组"""
+    import numpy as np
+    from PIL import Image
+
+    dhash_input = np.empty((len(paths), DHASH_SIZE, DHASH_SIZE + 1), dtype=np.float32)
+    phash_input = np.empty((len(paths), PHASH_SIZE, PHASH_SIZE), dtype=np.float64)
+    for i, path in enumerate(paths):
+        with Image.open(path) as image:
+            gray = image.convert('L')
+            dhash_input[i] = np.asarray(gray.resize((DHASH_SIZE + 1, DHASH_SIZE), Image.LANCZOS))
+            phash_input[i] = np.asarray(gray.resize((PHASH_SIZE, PHASH_SIZE), Image.LANCZOS))
+    return dhash_input, phash_input
+
+
+def file_sha1(path):
+    """计算文件内容的 SHA1"""
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _to_signed(values):
+    """SQLite 的 INTEGER 是有符号 64 位，存储前转换"""
+    import numpy as np
+
+    return values.astype(np.uint64).view(np.int64).tolist()
+
+
+def hash_batch(conn, batch_dir, rehash=False, verbose=True):
+    """为批次中尚未计算哈希的图片计算并保存哈希
+
+    Args:
+        conn (sqlite3.Connection): 批次数据库连接
+        batch_dir (str): 批次目录
+        rehash (bool): 是否重新计算所有图片
+        verbose (bool): 是否输出进度
+
+    Returns:
+        int: 本次计算的图片数量
+    """
+    init_hash_tables(conn)
+    cursor = conn.cursor()
+    if rehash:
+        cursor.execute('DELETE FROM image_hashes')
+    cursor.execute('''
+    SELECT DISTINCT r.image_path FROM image_records r
+    LEFT JOIN image_hashes h ON h.image_path = r.image_path
+    WHERE h.image_path IS NULL
+    ''')
+    pending = [row[0] for row in cursor.fetchall()
+               if os.path.exists(os.path.join(batch_dir, row[0]))]
+    if not pending:
+        return 0
+
+    progress = None
+    if verbose:
+        from tqdm import tqdm
+        progress = tqdm(total=len(pending), desc="计算哈希")
+    for start in range(0, len(pending), HASH_CHUNK_SIZE):
+        chunk = pending[start:start + HASH_CHUNK_SIZE]
+        paths = [os.path.join(batch_dir, image_path) for image_path in chunk]
+        dhash_input, phash_input = load_image_arrays(paths)
+        dhashes = _to_signed(compute_dhash(dhash_input))
+        phashes = _to_signed(compute_phash(phash_input))
+        sha1s = [file_sha1(path) for path in paths]
+        cursor.executemany('''
+        INSERT OR REPLACE INTO image_hashes (image_path, sha1, dhash, phash) VALUES (?, ?, ?, ?)
+        ''', list(zip(chunk, sha1s, dhashes, phashes)))
+        conn.commit()
+        if progress is not None:
+            progress.update(len(chunk))
+    if progress is not None:
+        progress.close()
+    return len(pending)
+
+
+def popcount64(values):
+    """向量化计算 uint64 数组每个元素中 1 的个数"""
+    import numpy as np
+
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(values).astype(np.int64)
+    table = np.array([bin(i).count('1') for i in range(256)], dtype=np.int64)
+    return table[values.view(np.uint8).reshape(-1, 8)].sum(axis=1)
+
+
+def _segment_bounds(threshold):
+    """按鸽巢原理把 64 位切成 threshold+1 段：距离不超过阈值的两个哈希至少有一段完全相同"""
+    import numpy as np
+
+    segments = min(threshold + 1, 64)
+    edges = np.linspace(0, 64, segments + 1).astype(int)
+    return list(zip(edges[:-1], edges[1:]))
+
+
+def find_near_pairs(hashes, threshold):
+    """多索引哈希查找汉明距离不超过阈值的所有索引对
+
+    Args:
+        hashes (np.ndarray): uint64 哈希数组
+        threshold (int): 汉明距离阈值
+
+    Returns:
+        tuple: (左索引数组, 右索引数组, 距离数组)，左索引总小于右索引
+    """
+    import numpy as np
+
+    hashes = np.asarray(hashes, dtype=np.uint64)
+    left_parts, right_parts = [], []
+    for low, high in _segment_bounds(threshold):
+        mask = np.uint64((1 << (high - low)) - 1)
+        keys = (hashes >> np.uint64(low)) & mask
+        order = np.argsort(keys, kind='stable')
+        sorted_keys = keys[order]
+        # 排序后段值相同的元素相邻，按偏移量逐层取出同一区间内的所有候选对
+        offset = 1
+        while offset < len(order):
+            same = np.flatnonzero(sorted_keys[offset:] == sorted_keys[:-offset])
+            if len(same) == 0:
+                break
+            left = order[same]
+            right = order[same + offset]
+            distances = popcount64(hashes[left] ^ hashes[right])
+            keep = distances <= threshold
+            left_parts.append(left[keep])
+            right_parts.append(right[keep])
+            offset += 1
+
+    if not left_parts:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty, empty
+
+    left = np.concatenate(left_parts)
+    right = np.concatenate(right_parts)
+    left, right = np.minimum(left, right), np.maximum(left, right)
+    # 同一对可能在多个段中命中，去重
+    pairs = np.unique(np.stack([left, right], axis=1), axis=0).reshape(-1, 2)
+    left, right = pairs[:, 0], pairs[:, 1]
+    return left, right, popcount64(hashes[left] ^ hashes[right])
+
+
+def find_duplicates(conn, threshold=NEAR_DUPLICATE_THRESHOLD):
+    """查找完全相同和近似重复的图片，结果写入 image_duplicates 表
+
+    内容完全相同的图片指向同组中 id 最小的记录；其余图片只指向汉明距离不超过阈值、
+    且本身没有被判定为重复的更早图片，因此记录的距离不会超过阈值。
+
+    Returns:
+        list: [(image_path, duplicate_of, distance, kind), ...]
+    """
+    import numpy as np
+
+    init_hash_tables(conn)
+    cursor = conn.cursor()
+    cursor.execute('''
+    SELECT h.image_path, h.sha1, h.phash, MIN(r.id) FROM image_hashes h
+    JOIN image_records r ON r.image_path = h.image_path
+    GROUP BY h.image_path
+    ORDER BY MIN(r.id)
+    ''')
+    rows = cursor.fetchall()
+    cursor.execute('DELETE FROM image_duplicates')
+    if len(rows) < 2:
+        conn.commit()
+        return []
+
+    paths = [row[0] for row in rows]
+    sha1s = [row[1] for row in rows]
+    phashes = np.array([row[2] for row in rows], dtype=np.int64).view(np.uint64)
+
+    # 先按内容 SHA1 分组：同组中 id 最小的图片作为代表，其余为完全重复
+    duplicates = []
+    representatives = []
+    first_by_sha1 = {}
+    for index, sha1 in enumerate(sha1s):
+        if sha1 in first_by_sha1:
+            duplicates.append((paths[index], paths[first_by_sha1[sha1]], 0, 'exact'))
+        else:
+            first_by_sha1[sha1] = index
+            representatives.append(index)
+
+    # 再在代表之间查找近似重复。按 id 顺序处理，每张图片只指向距离确实不超过阈值、
+    # 且自身不是重复的更早图片，避免 A~B、B~C 时把距离更远的 C 传递地归到 A
+    rep_hashes = phashes[representatives]
+    left, right, distances = find_near_pairs(rep_hashes, threshold)
+    neighbors = defaultdict(list)
+    for a, b, distance in zip(left.tolist(), right.tolist(), distances.tolist()):
+        neighbors[b].append((a, distance))
+
+    canonical = [True] * len(representatives)
+    for position in range(len(representatives)):
+        matches = [(a, distance) for a, distance in neighbors.get(position, []) if canonical[a]]
+        if not matches:
+            continue
+        a, distance = min(matches)
+        canonical[position] = False
+        duplicates.append((paths[representatives[position]], paths[representatives[a]], distance, 'near'))
+
+    cursor.executemany('''
+    INSERT INTO image_duplicates (image_path, duplicate_of, distance, kind) VALUES (?, ?, ?, ?)
+    ''', duplicates)
+    conn.commit()
+    return duplicates
+
+
+def find_collapsed_artists(conn, ratio=ARTIST_COLLAPSE_RATIO):
+    """找出在大部分共同提示词下都产生重复图片的艺术家对"""
+    cursor = conn.cursor()
+    cursor.execute('SELECT image_path, duplicate_of FROM image_duplicates')
+    duplicate_of = dict(cursor.fetchall())
+
+    def root(image_path):
+        # 完全重复的图片可能指向一张近似重复的图片，沿链找到真正的原图
+        seen = set()
+        while image_path in duplicate_of and image_path not in seen:
+            seen.add(image_path)
+            image_path = duplicate_of[image_path]
+        return image_path
+
+    cursor.execute('SELECT artist_prompt, prompt_text, image_path FROM image_records')
+    groups = defaultdict(set)
+    prompts_per_artist = defaultdict(set)
+    for artist, prompt, image_path in cursor.fetchall():
+        groups[(prompt, root(image_path))].add(artist)
+        prompts_per_artist[artist].add(prompt)
+
+    shared = defaultdict(int)
+    for artists in groups.values():
+        for pair in combinations(sorted(artists), 2):
+            shared[pair] += 1
+
+    collapsed = []
+    for (artist_a, artist_b), count in shared.items():
+        common = len(prompts_per_artist[artist_a] & prompts_per_artist[artist_b])
+        if common and count / common >= ratio:
+            collapsed.append((artist_a, artist_b, count, common))
+    return sorted(collapsed, key=lambda item: (-item[2] / item[3], item[0]))
+
+
+def process_batch_hashes(conn, batch_dir, threshold=NEAR_DUPLICATE_THRESHOLD, rehash=False, verbose=True):
+    """生成后处理：计算哈希、查找重复并输出报告"""
+    hashed = hash_batch(conn, batch_dir, rehash=rehash, verbose=verbose)
+    duplicates = find_duplicates(conn, threshold)
+    collapsed = find_collapsed_artists(conn)
+    if verbose:
+        exact = sum(1 for d in duplicates if d[3] == 'exact')
+        print(f"新计算哈希 {hashed} 张，完全重复 {exact} 张，近似重复 {len(duplicates) - exact} 张")
+        for image_path, duplicate_of, distance, kind in duplicates[:20]:
+            print(f"  [{kind}] {image_path} -> {duplicate_of} (距离 {distance})")
+        if len(duplicates) > 20:
+            print(f"  ... 另有 {len(duplicates) - 20} 条")
+        for artist_a, artist_b, count, common in collapsed:
+            print(f"风格坍缩: {artist_a} ≈ {artist_b}（{count}/{common} 个提示词重复）")
+    return duplicates, collapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='计算批次图片的感知哈希并检测重复')
+    parser.add_argument('batch_dir', type=str, help='批次目录，包含 image_generation.db')
+    parser.add_argument('--threshold', type=int, default=NEAR_DUPLICATE_THRESHOLD, help='近似重复的汉明距离阈值')
+    parser.add_argument('--rehash', action='store_true', help='重新计算所有图片的哈希')
+    parser.add_argument('--json', type=str, help='把重复报告写入指定 JSON 文件')
+    args = parser.parse_args()
+
+    db_path = os.path.join(args.batch_dir, 'image_generation.db')
+    if not os.path.exists(db_path):
+        print(f"找不到数据库: {db_path}")
+        return
+
+    conn = sqlite3.connect(db_path)
+    try:
+        duplicates, collapsed = process_batch_hashes(conn, args.batch_dir, args.threshold, args.rehash)
+    finally:
+        conn.close()
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({
+                'duplicates': [dict(zip(('image_path', 'duplicate_of', 'distance', 'kind'), d)) for d in duplicates],
+                'collapsed_artists': [dict(zip(('artist_a', 'artist_b', 'duplicate_prompts', 'common_prompts'), c))
+                                      for c in collapsed]
+            }, f, ensure_ascii=False, indent=2)
+        print(f"报告已保存到: {args.json}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,604 @@
+"""
+本地生成任务队列服务
+
+任务和单元格都保存在SQLite中（无需外部消息队列），服务为每个WebUI后端启动一个工作线程，
+按优先级和公平分配从所有进行中的任务里领取单元格：
+- 优先级高的任务先调度；
+- 同一优先级内按提交者轮转，正在运行单元格少、最久没有被调度的提交者优先；
+- 同一提交者的多个任务之间同样按运行中的单元格数量均分。
+
+服务重启后，未完成的单元格会重新排队。每个任务的输出是一个普通批次目录，
+可以直接用 upload_to_r2.py 上传并在网站上展示。
+
+示例：
+    python job_queue.py serve
+    python job_queue.py submit --owner alice --priority 5 \\
+        --artists prompts/aritsts_folder/artist_test.csv --prompts prompts/prompts_folder/prompt_string.csv
+    python job_queue.py status --follow
+    python job_queue.py cancel 3
+"""
+import argparse
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from config import *
+
+JOB_ACTIVE_STATUSES = ('pending', 'running')
+
+
+def connect(db_path=JOB_QUEUE_DB):
+    """打开队列数据库，使用WAL以便读写并发"""
+    os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+    conn = sqlite3.connect(db_path, timeout=30, isolation_level=None)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def init_queue_database(conn):
+    """创建任务表、单元格表和提交者调度表"""
+    conn.executescript('''
+    CREATE TABLE IF NOT EXISTS jobs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        owner TEXT NOT NULL,
+        priority INTEGER NOT NULL DEFAULT 0,
+        status TEXT NOT NULL DEFAULT 'pending',
+        artist_file TEXT NOT NULL,
+        prompt_file TEXT NOT NULL,
+        seed INTEGER NOT NULL,
+        batch_dir TEXT,
+        created_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        finished_time TIMESTAMP
+    );
+    CREATE TABLE IF NOT EXISTS cells (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        job_id INTEGER NOT NULL REFERENCES jobs(id),
+        artist_prompt TEXT NOT NULL,
+        prompt_text TEXT NOT NULL,
+        status TEXT NOT NULL DEFAULT 'pending',
+        backend TEXT,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        image_path TEXT,
+        error TEXT,
+        started_time TIMESTAMP,
+        finished_time TIMESTAMP
+    );
+    CREATE INDEX IF NOT EXISTS idx_cells_job_status ON cells (job_id, status);
+    CREATE TABLE IF NOT EXISTS owners (
+        owner TEXT PRIMARY KEY,
+        last_claim REAL NOT NULL DEFAULT 0
+    );
+    ''')
+
+
+def recover_interrupted_cells(conn):
+    """服务重启时把上次运行中的单元格放回队列"""
+    cursor = conn.execute("UPDATE cells SET status = 'pending', backend = NULL WHERE status = 'running'")
+    return cursor.rowcount
+
+
+def submit_job(conn, owner, artists, prompts, artist_file, prompt_file, priority=0, seed=DEFAULT_SEED):
+    """提交一个生成任务，返回任务id；没有艺术家或提示词时抛出ValueError"""
+    if not artists or not prompts:
+        # 没有单元格的任务永远不会被领取，也就永远不会结束
+        raise ValueError('artists and prompts must not be empty')
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        cursor = conn.execute('''
+        INSERT INTO jobs (owner, priority, artist_file, prompt_file, seed) VALUES (?, ?, ?, ?, ?)
+        ''', (owner, priority, artist_file, prompt_file, seed))
+        job_id = cursor.lastrowid
+        conn.executemany('''
+        INSERT INTO cells (job_id, artist_prompt, prompt_text) VALUES (?, ?, ?)
+        ''', [(job_id, artist, prompt) for artist in artists for prompt in prompts])
+        conn.execute('INSERT OR IGNORE INTO owners (owner) VALUES (?)', (owner,))
+        conn.execute('COMMIT')
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+    return job_id
+
+
+def claim_next_cell(conn, backend):
+    """按优先级和公平分配原则领取下一个单元格，没有可领取的单元格时返回None"""
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        jobs = conn.execute('''
+        SELECT j.id, j.owner, j.priority,
+               (SELECT COUNT(*) FROM cells c WHERE c.job_id = j.id AND c.status = 'running') AS running,
+               COALESCE(o.last_claim, 0) AS last_claim
+        FROM jobs j
+        LEFT JOIN owners o ON o.owner = j.owner
+        WHERE j.status IN ('pending', 'running')
+          AND EXISTS (SELECT 1 FROM cells c WHERE c.job_id = j.id AND c.status = 'pending')
+        ''').fetchall()
+        if not jobs:
+            conn.execute('COMMIT')
+            return None
+
+        top_priority = max(job['priority'] for job in jobs)
+        candidates = [job for job in jobs if job['priority'] == top_priority]
+        owner_running = {}
+        for job in candidates:
+            owner_running[job['owner']] = owner_running.get(job['owner'], 0) + job['running']
+        # 运行中的单元格最少、最久未被调度的提交者优先，其次是该提交者运行中单元格最少、最早提交的任务
+        job = min(candidates, key=lambda j: (owner_running[j['owner']], j['last_claim'], j['running'], j['id']))
+
+        cell = conn.execute('''
+        SELECT id FROM cells WHERE job_id = ? AND status = 'pending' ORDER BY id LIMIT 1
+        ''', (job['id'],)).fetchone()
+        conn.execute('''
+        UPDATE cells SET status = 'running', backend = ?, attempts = attempts + 1, started_time = CURRENT_TIMESTAMP
+        WHERE id = ?
+        ''', (backend, cell['id']))
+        conn.execute("UPDATE jobs SET status = 'running' WHERE id = ? AND status = 'pending'", (job['id'],))
+        conn.execute('INSERT OR REPLACE INTO owners (owner, last_claim) VALUES (?, ?)', (job['owner'], time.time()))
+        conn.execute('COMMIT')
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+    return conn.execute('''
+    SELECT c.*, j.artist_file, j.prompt_file, j.seed, j.batch_dir
+    FROM cells c JOIN jobs j ON j.id = c.job_id WHERE c.id = ?
+    ''', (cell['id'],)).fetchone()
+
+
+def finish_cell(conn, cell_id, image_path=None, error=None):
+    """标记单元格完成或失败，失败次数未达上限时重新排队；返回任务是否已全部结束
+
+    所有单元格结束后，任务状态为 done（全部成功）、partial（部分失败）或 failed（全部失败）。
+    """
+    if error is None:
+        conn.execute('''
+        UPDATE cells SET status = 'done', image_path = ?, error = NULL, finished_time = CURRENT_TIMESTAMP
+        WHERE id = ?
+        ''', (image_path, cell_id))
+    else:
+        conn.execute('''
+        UPDATE cells SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END,
+                         backend = NULL, error = ?, finished_time = CURRENT_TIMESTAMP
+        WHERE id = ?
+        ''', (JOB_MAX_ATTEMPTS, error, cell_id))
+
+    job_id = conn.execute('SELECT job_id FROM cells WHERE id = ?', (cell_id,)).fetchone()['job_id']
+    remaining = conn.execute('''
+    SELECT COUNT(*) FROM cells WHERE job_id = ? AND status IN ('pending', 'running')
+    ''', (job_id,)).fetchone()[0]
+    if remaining:
+        return False
+    cursor = conn.execute('''
+    UPDATE jobs SET status = CASE
+            WHEN NOT EXISTS (SELECT 1 FROM cells WHERE job_id = jobs.id AND status = 'failed') THEN 'done'
+            WHEN EXISTS (SELECT 1 FROM cells WHERE job_id = jobs.id AND status = 'done') THEN 'partial'
+            ELSE 'failed' END,
+        finished_time = CURRENT_TIMESTAMP
+    WHERE id = ? AND status = 'running'
+    ''', (job_id,))
+    return cursor.rowcount > 0
+
+
+def requeue_cell(conn, cell_id, error):
+    """后端不可用时把单元格放回队列，本次尝试不计入失败次数"""
+    conn.execute('''
+    UPDATE cells SET status = 'pending', attempts = MAX(attempts - 1, 0), backend = NULL, error = ?
+    WHERE id = ? AND status = 'running'
+    ''', (error, cell_id))
+
+
+def is_backend_error(error):
+    """连接失败或超时说明后端不可用，与单元格本身无关"""
+    if isinstance(error, (ConnectionError, TimeoutError)):
+        return True
+    # webuiapi 使用 requests，此时它已经被导入
+    import requests
+    return isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout))
+
+
+def cancel_job(conn, job_id):
+    """取消尚未结束的任务，已在运行中的单元格会继续完成
+
+    Returns:
+        int: 不再生成的单元格数量；任务不存在或已经结束时返回None
+    """
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        cursor = conn.execute('''
+        UPDATE jobs SET status = 'cancelled', finished_time = CURRENT_TIMESTAMP
+        WHERE id = ? AND status IN ('pending', 'running')
+        ''', (job_id,))
+        if cursor.rowcount == 0:
+            conn.execute('COMMIT')
+            return None
+        cursor = conn.execute("UPDATE cells SET status = 'cancelled' WHERE job_id = ? AND status = 'pending'", (job_id,))
+        conn.execute('COMMIT')
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+    return cursor.rowcount
+
+
+def get_job_progress(conn, job_id=None):
+    """返回任务进度列表，每项包含各状态的单元格数量"""
+    query = '''
+    SELECT j.id, j.owner, j.priority, j.status, j.artist_file, j.prompt_file, j.batch_dir,
+           j.created_time, j.finished_time,
+           COUNT(c.id) AS total,
+           SUM(c.status = 'done') AS done,
+           SUM(c.status = 'running') AS running,
+           SUM(c.status = 'pending') AS pending,
+           SUM(c.status = 'failed') AS failed
+    FROM jobs j LEFT JOIN cells c ON c.job_id = j.id
+    {where}
+    GROUP BY j.id ORDER BY j.id
+    '''
+    if job_id is None:
+        rows = conn.execute(query.format(where='')).fetchall()
+    else:
+        rows = conn.execute(query.format(where='WHERE j.id = ?'), (job_id,)).fetchall()
+    return [dict(row) for row in rows]
+
+
+def format_progress(job):
+    """把任务进度格式化为一行文本"""
+    total = job['total'] or 0
+    done = job['done'] or 0
+    percent = done / total * 100 if total else 0
+    return (f"#{job['id']} [{job['status']}] {job['owner']} p={job['priority']} "
+            f"{done}/{total} ({percent:.1f}%) 运行 {job['running'] or 0} 失败 {job['failed'] or 0} "
+            f"{job['artist_file']} × {job['prompt_file']}")
+
+
+class BackendWorker(threading.Thread):
+    """绑定到一个WebUI后端的工作线程"""
+
+    def __init__(self, host, port, db_path, stop_event):
+        super().__init__(name=f"backend-{host}:{port}", daemon=True)
+        self.host = host
+        self.port = port
+        self.backend = f"{host}:{port}"
+        self.db_path = db_path
+        self.stop_event = stop_event
+
+    def run(self):
+        from generate_image import create_api, log_error, log_info
+
+        conn = connect(self.db_path)
+        api_client = create_api(self.host, self.port)
+        cache = None
+        if GENERATION_CACHE_ENABLED:
+            from generation_cache import GenerationCache
+            cache = GenerationCache()
+        log_info(f"后端 {self.backend} 已就绪")
+
+        while not self.stop_event.is_set():
+            cell = None
+            try:
+                cell = claim_next_cell(conn, self.backend)
+                if cell is None:
+                    self.stop_event.wait(JOB_POLL_INTERVAL)
+                    continue
+                image_filename = self.process_cell(conn, cell, api_client, cache)
+                job_finished = finish_cell(conn, cell['id'], image_path=image_filename)
+            except Exception as e:
+                # 任何异常都不能让工作线程退出，否则已领取的单元格会一直停留在运行中
+                if cell is None:
+                    log_error(f"[{self.backend}] 领取单元格失败: {str(e)}")
+                    self.stop_event.wait(JOB_POLL_INTERVAL)
+                    continue
+                backend_error = is_backend_error(e)
+                if backend_error:
+                    log_error(f"[{self.backend}] 后端不可用，单元格 {cell['id']} 重新排队: {str(e)}")
+                else:
+                    log_error(f"[{self.backend}] 单元格 {cell['id']} 生成失败: {str(e)}")
+                job_finished = self.release_cell(conn, cell, str(e), backend_error)
+                if backend_error:
+                    # 暂停这个后端，单元格由其他正常的后端领取
+                    self.stop_event.wait(BACKEND_RETRY_DELAY)
+
+            if job_finished:
+                self.finish_job(conn, cell['job_id'])
+
+        if cache is not None:
+            log_info(f"[{self.backend}] {cache.summary()}")
+            cache.close()
+        conn.close()
+
+    def process_cell(self, conn, cell, api_client, cache):
+        """生成一个单元格并写入批次数据库，返回图片文件名"""
+        from batch_generate import generate_and_save_with_record, init_database
+        from generate_image import get_current_model, log_error
+        from generation_cache import init_cache_hits_table, is_cacheable
+
+        batch_dir = cell['batch_dir'] or ensure_job_batch_dir(conn, cell['job_id'])
+        image_filename = FILENAME_TEMPLATE.format(
+            timestamp=f"job{cell['job_id']}", index=cell['id'], format=IMAGE_SAVE_FORMAT)
+        batch_conn = init_database(batch_dir)
+        try:
+            init_cache_hits_table(batch_conn)
+            # 重启后重做的单元格可能已经写过记录，先删除避免重复
+            batch_conn.execute('DELETE FROM image_records WHERE image_path = ?', (image_filename,))
+            batch_conn.execute('DELETE FROM stage_timings WHERE image_path = ?', (image_filename,))
+            batch_conn.commit()
+            seed = cell['seed']
+            model = get_current_model(api_client) if is_cacheable(seed) else None
+            if is_cacheable(seed) and not model:
+                log_error(f"[{self.backend}] 无法获取当前模型，单元格 {cell['id']} 不使用生成缓存")
+            combined_prompt = f"{DEFAULT_QUALITY_PROMPT}{cell['artist_prompt']},{cell['prompt_text']}"
+            generate_and_save_with_record(
+                combined_prompt,
+                cell['artist_file'],
+                cell['artist_prompt'],
+                cell['prompt_file'],
+                cell['prompt_text'],
+                batch_conn,
+                batch_dir,
+                cache=cache,
+                model=model,
+                seed=seed,
+                api_client=api_client,
+                image_filename=image_filename
+            )
+        finally:
+            batch_conn.close()
+        return image_filename
+
+    def release_cell(self, conn, cell, error, backend_error=False):
+        """把失败的单元格重新排队或标记失败，返回任务是否已全部结束
+
+        后端不可用导致的失败不计入单元格的尝试次数。
+        """
+        from generate_image import log_error
+
+        try:
+            if backend_error:
+                requeue_cell(conn, cell['id'], error)
+                return False
+            return finish_cell(conn, cell['id'], error=error)
+        except Exception as e:
+            log_error(f"[{self.backend}] 单元格 {cell['id']} 状态更新失败，将在服务重启后重新排队: {str(e)}")
+            return False
+
+    def finish_job(self, conn, job_id):
+        """任务的所有单元格结束后执行后处理"""
+        from generate_image import log_error, log_info
+
+        try:
+            job = conn.execute('SELECT status, batch_dir FROM jobs WHERE id = ?', (job_id,)).fetchone()
+            log_info(f"任务 #{job_id} 已结束 [{job['status']}]: {job['batch_dir']}")
+            if job['batch_dir']:
+                finalize_job(job['batch_dir'])
+        except Exception as e:
+            log_error(f"任务 #{job_id} 后处理失败: {str(e)}")
+
+
+_batch_dir_lock = threading.Lock()
+
+
+def ensure_job_batch_dir(conn, job_id):
+    """任务第一次被调度时创建它的批次目录"""
+    from batch_generate import get_batch_dir
+
+    with _batch_dir_lock:
+        row = conn.execute('SELECT batch_dir FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        if row['batch_dir']:
+            return row['batch_dir']
+        batch_dir = get_batch_dir(suffix=f"job{job_id}")
+        conn.execute('UPDATE jobs SET batch_dir = ? WHERE id = ?', (batch_dir, job_id))
+        return batch_dir
+
+
+def finalize_job(batch_dir):
+    """任务完成后的处理：检测重复图片"""
+    from batch_generate import init_stage_timings_table, save_stage_timing
+    from image_dedup import process_batch_hashes
+
+    db_path = os.path.join(batch_dir, 'image_generation.db')
+    if not os.path.exists(db_path):
+        return
+    batch_conn = sqlite3.connect(db_path)
+    try:
+        start = time.perf_counter()
+        process_batch_hashes(batch_conn, batch_dir, verbose=False)
+        init_stage_timings_table(batch_conn)
+        save_stage_timing(batch_conn, 'dedup', time.perf_counter() - start)
+        batch_conn.commit()
+    finally:
+        batch_conn.close()
+
+
+class QueueRequestHandler(BaseHTTPRequestHandler):
+    """任务队列的HTTP接口"""
+
+    db_path = JOB_QUEUE_DB
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, data, status=200):
+        body = json.dumps(data, ensure_ascii=False, default=str).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        conn = connect(self.db_path)
+        try:
+            if self.path == '/jobs':
+                return self.send_json(get_job_progress(conn))
+            match = re.fullmatch(r'/jobs/(\d+)(/events)?', self.path)
+            if not match:
+                return self.send_json({'error': 'not found'}, 404)
+            job_id = int(match.group(1))
+            jobs = get_job_progress(conn, job_id)
+            if not jobs:
+                return self.send_json({'error': 'job not found'}, 404)
+            if not match.group(2):
+                return self.send_json(jobs[0])
+            self.stream_progress(conn, job_id)
+        finally:
+            conn.close()
+
+    def stream_progress(self, conn, job_id):
+        """以server-sent events推送任务进度，任务结束后关闭连接"""
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-store')
+        self.end_headers()
+        last = None
+        try:
+            while True:
+                job = get_job_progress(conn, job_id)[0]
+                if job != last:
+                    payload = json.dumps(job, ensure_ascii=False, default=str)
+                    self.wfile.write(f"event: progress\ndata: {payload}\n\n".encode('utf-8'))
+                    self.wfile.flush()
+                    last = job
+                if job['status'] not in JOB_ACTIVE_STATUSES:
+                    break
+                time.sleep(JOB_POLL_INTERVAL)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def do_POST(self):
+        conn = connect(self.db_path)
+        try:
+            match = re.fullmatch(r'/jobs/(\d+)/cancel', self.path)
+            if match:
+                cancelled = cancel_job(conn, int(match.group(1)))
+                if cancelled is None:
+                    return self.send_json({'error': 'job not found or already finished'}, 404)
+                return self.send_json({'cancelled_cells': cancelled})
+            if self.path != '/jobs':
+                return self.send_json({'error': 'not found'}, 404)
+            length = int(self.headers.get('Content-Length', 0))
+            try:
+                data = json.loads(self.rfile.read(length) or b'{}')
+                artists = data.get('artists') or read_prompt_file(data['artist_file'])
+                prompts = data.get('prompts') or read_prompt_file(data['prompt_file'])
+                job_id = submit_job(
+                    conn, data['owner'], artists, prompts,
+                    os.path.basename(data.get('artist_file', 'api')),
+                    os.path.basename(data.get('prompt_file', 'api')),
+                    priority=int(data.get('priority', 0)),
+                    seed=int(data.get('seed', DEFAULT_SEED))
+                )
+            except (KeyError, ValueError, OSError) as e:
+                return self.send_json({'error': f'invalid job: {e}'}, 400)
+            self.send_json(get_job_progress(conn, job_id)[0], 201)
+        finally:
+            conn.close()
+
+
+def read_prompt_file(path):
+    """读取艺术家或提示词CSV"""
+    from batch_generate import read_csv_content
+    return read_csv_content(path)
+
+
+def serve(db_path, host, port):
+    """启动所有后端工作线程和HTTP接口"""
+    from generate_image import log_info
+
+    conn = connect(db_path)
+    init_queue_database(conn)
+    recovered = recover_interrupted_cells(conn)
+    conn.close()
+    if recovered:
+        log_info(f"已把 {recovered} 个中断的单元格重新排队")
+
+    stop_event = threading.Event()
+    workers = [BackendWorker(backend_host, backend_port, db_path, stop_event)
+               for backend_host, backend_port in API_BACKENDS]
+    for worker in workers:
+        worker.start()
+
+    QueueRequestHandler.db_path = db_path
+    server = ThreadingHTTPServer((host, port), QueueRequestHandler)
+    server.daemon_threads = True
+    log_info(f"任务队列服务已启动: http://{host}:{port}，后端 {len(workers)} 个")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        log_info("正在停止，等待运行中的单元格完成...")
+        server.server_close()
+        stop_event.set()
+        for worker in workers:
+            worker.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='本地生成任务队列')
+    parser.add_argument('--db', type=str, default=JOB_QUEUE_DB, help='队列数据库路径')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    serve_parser = subparsers.add_parser('serve', help='启动队列服务')
+    serve_parser.add_argument('--host', type=str, default=JOB_QUEUE_HOST)
+    serve_parser.add_argument('--port', type=int, default=JOB_QUEUE_PORT)
+
+    submit_parser = subparsers.add_parser('submit', help='提交生成任务')
+    submit_parser.add_argument('--owner', type=str, required=True, help='提交者，用于公平分配')
+    submit_parser.add_argument('--artists', type=str, required=True, help='艺术家CSV文件')
+    submit_parser.add_argument('--prompts', type=str, required=True, help='提示词CSV文件')
+    submit_parser.add_argument('--priority', type=int, default=0, help='优先级，数值越大越先调度')
+    submit_parser.add_argument('--seed', type=int, default=DEFAULT_SEED, help='随机种子，-1表示随机')
+
+    status_parser = subparsers.add_parser('status', help='查看任务进度')
+    status_parser.add_argument('job_id', type=int, nargs='?', help='任务id，默认显示全部')
+    status_parser.add_argument('--follow', action='store_true', help='持续刷新直到任务结束')
+
+    cancel_parser = subparsers.add_parser('cancel', help='取消任务')
+    cancel_parser.add_argument('job_id', type=int)
+
+    args = parser.parse_args()
+
+    if args.command == 'serve':
+        serve(args.db, args.host, args.port)
+        return
+
+    conn = connect(args.db)
+    init_queue_database(conn)
+    try:
+        if args.command == 'submit':
+            artists = read_prompt_file(args.artists)
+            prompts = read_prompt_file(args.prompts)
+            if not artists or not prompts:
+                print("错误：艺术家或提示词文件为空，任务没有任何单元格")
+                return
+            job_id = submit_job(conn, args.owner, artists, prompts,
+                                os.path.basename(args.artists), os.path.basename(args.prompts),
+                                priority=args.priority, seed=args.seed)
+            print(f"已提交任务 #{job_id}，共 {len(artists) * len(prompts)} 个单元格")
+        elif args.command == 'cancel':
+            cancelled = cancel_job(conn, args.job_id)
+            if cancelled is None:
+                print(f"任务 #{args.job_id} 不存在或已经结束")
+            else:
+                print(f"已取消任务 #{args.job_id}，{cancelled} 个单元格不再生成")
+        elif args.command == 'status':
+            while True:
+                jobs = get_job_progress(conn, args.job_id)
+                if not jobs:
+                    print("没有任务")
+                    return
+                print(f"[{datetime.now().strftime('%H:%M:%S')}]")
+                for job in jobs:
+                    print(format_progress(job))
+                if not args.follow or all(job['status'] not in JOB_ACTIVE_STATUSES for job in jobs):
+                    return
+                time.sleep(JOB_POLL_INTERVAL * 5)
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
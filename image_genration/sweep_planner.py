@@ -0,0 +1,330 @@
+"""
+批量生成的试运行计划
+
+读取最近若干个批次数据库中记录的各阶段耗时（stage_timings 表；没有该表的旧批次用
+generation_time 相邻记录的间隔估算）和磁盘上图片的平均大小，估算一次扫描在不同后端
+数量下的总耗时、GPU 时长、输出大小和上传时间，并推荐后端数量。
+
+示例：
+    python sweep_planner.py --cells 2968
+    python sweep_planner.py --cells 2968 --deadline 4 --json plan.json
+"""
+import argparse
+import glob
+import json
+import math
+import os
+import sqlite3
+from datetime import datetime
+from pathlib import Path
+
+from config import *
+
+# generation_time 相邻记录的间隔超过该值（秒）视为生成中断，不计入耗时
+MAX_RECORD_GAP_SECONDS = 300
+# 每个批次最多统计多少张图片的文件大小
+SIZE_SAMPLE_PER_BATCH = 500
+# 报告中列出的后端数量
+BACKEND_COUNTS = (1, 2, 4, 8, 16)
+
+
+def connect_readonly(db_path):
+    """只读打开数据库，试运行不会修改历史批次"""
+    return sqlite3.connect(Path(db_path).resolve().as_uri() + '?mode=ro', uri=True)
+
+
+def table_exists(cursor, name):
+    """检查数据库中是否存在指定的表"""
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,))
+    return cursor.fetchone() is not None
+
+
+def list_history_batches(batch_root=BATCH_ROOT, limit=PLANNER_HISTORY_BATCHES):
+    """按名称（即创建时间）倒序列出最近的批次目录"""
+    if not os.path.isdir(batch_root):
+        return []
+    names = sorted((name for name in os.listdir(batch_root)
+                    if os.path.exists(os.path.join(batch_root, name, 'image_generation.db'))), reverse=True)
+    return [os.path.join(batch_root, name) for name in names[:limit]]
+
+
+def generation_time_deltas(records, cached):
+    """用相邻记录的 generation_time 间隔估算生成耗时，返回 (样本数, 总秒数)
+
+    generation_time 只精确到秒，单个间隔误差较大，但对整个批次求平均足够准确。
+    复用缓存的记录和中断造成的长间隔不计入。
+    """
+    count, total = 0, 0.0
+    previous = None
+    for image_path, generation_time in records:
+        try:
+            current = datetime.strptime(generation_time, '%Y-%m-%d %H:%M:%S')
+        except (TypeError, ValueError):
+            previous = None
+            continue
+        if previous is not None and image_path not in cached:
+            delta = (current - previous).total_seconds()
+            if 0 <= delta <= MAX_RECORD_GAP_SECONDS:
+                count += 1
+                total += delta
+        previous = current
+    return count, total
+
+
+def read_batch_history(batch_dir):
+    """读取单个批次的耗时、文件大小和重复数量
+
+    Returns:
+        dict: 各项的样本数与总量，source 表示生成耗时的来源（stage_timings / generation_time / None）
+    """
+    history = {
+        'batch': os.path.basename(os.path.normpath(batch_dir)),
+        'source': None,
+        'images': 0,
+        'generate_count': 0,
+        'generate_seconds': 0.0,
+        'save_count': 0,
+        'save_seconds': 0.0,
+        'dedup_seconds': 0.0,
+        'duplicates': 0,
+        'size_count': 0,
+        'size_bytes': 0
+    }
+    conn = connect_readonly(os.path.join(batch_dir, 'image_generation.db'))
+    try:
+        cursor = conn.cursor()
+        if not table_exists(cursor, 'image_records'):
+            return history
+        cursor.execute('SELECT image_path, generation_time FROM image_records ORDER BY id')
+        records = cursor.fetchall()
+        history['images'] = len(records)
+
+        stages = {}
+        if table_exists(cursor, 'stage_timings'):
+            cursor.execute('SELECT stage, COUNT(*), SUM(seconds) FROM stage_timings GROUP BY stage')
+            stages = {stage: (count, total) for stage, count, total in cursor.fetchall()}
+
+        if 'generate' in stages:
+            history['source'] = 'stage_timings'
+            history['generate_count'], history['generate_seconds'] = stages['generate']
+            history['save_count'], history['save_seconds'] = stages.get('save', (0, 0.0))
+        elif '-job' not in history['batch']:
+            # 任务队列的批次可能由多个后端并行生成，记录间隔不代表单张耗时
+            cached = set()
+            if table_exists(cursor, 'cache_hits'):
+                cursor.execute('SELECT image_path FROM cache_hits')
+                cached = {row[0] for row in cursor.fetchall()}
+            count, total = generation_time_deltas(records, cached)
+            if count:
+                history['source'] = 'generation_time'
+                history['generate_count'], history['generate_seconds'] = count, total
+
+        if 'dedup' in stages:
+            # 续跑的批次可能检测过多次，取平均
+            count, total = stages['dedup']
+            history['dedup_seconds'] = total / count
+
+        if table_exists(cursor, 'image_duplicates'):
+            cursor.execute('SELECT COUNT(*) FROM image_duplicates')
+            history['duplicates'] = cursor.fetchone()[0]
+    finally:
+        conn.close()
+
+    for image_path, _ in records[-SIZE_SAMPLE_PER_BATCH:]:
+        try:
+            history['size_bytes'] += os.stat(os.path.join(batch_dir, image_path)).st_size
+            history['size_count'] += 1
+        except OSError:
+            continue
+    return history
+
+
+def summarize_history(histories):
+    """把多个批次的记录汇总为每张图片的平均值，缺少的数据使用配置中的默认值"""
+    def total(key):
+        return sum(h[key] for h in histories)
+
+    generate_count = total('generate_count')
+    save_count = total('save_count')
+    size_count = total('size_count')
+    images = total('images')
+    dedup_images = sum(h['images'] for h in histories if h['dedup_seconds'])
+    return {
+        'batches': len(histories),
+        'timed_batches': sum(1 for h in histories if h['source'] == 'stage_timings'),
+        'estimated_batches': sum(1 for h in histories if h['source'] == 'generation_time'),
+        'seconds_per_image': total('generate_seconds') / generate_count if generate_count
+        else PLANNER_DEFAULT_SECONDS_PER_IMAGE,
+        'save_seconds_per_image': total('save_seconds') / save_count if save_count else 0.0,
+        'dedup_seconds_per_image': sum(h['dedup_seconds'] for h in histories) / dedup_images if dedup_images
+        else 0.0,
+        'bytes_per_image': total('size_bytes') / size_count if size_count else PLANNER_DEFAULT_IMAGE_BYTES,
+        'duplicate_ratio': total('duplicates') / images if images else 0.0
+    }
+
+
+def load_upload_throughput(results_dir=PLANNER_BENCH_RESULTS_DIR):
+    """从最近一次包含上传测试的基准结果中读取上传速度，返回 (MB/s, 来源文件名)"""
+    for path in sorted(glob.glob(os.path.join(results_dir, '*.json')), reverse=True):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            continue
+        mb_per_sec = data.get('results', {}).get('upload', {}).get('mb_per_sec')
+        if mb_per_sec:
+            return mb_per_sec, os.path.basename(path)
+    return PLANNER_DEFAULT_UPLOAD_MBPS, None
+
+
+def plan_sweep(cells, history, upload_mbps, deadline_hours=None):
+    """
+    估算一次扫描的耗时与存储，并推荐后端数量
+
+    生成阶段按后端数量并行，每个后端依次处理分到的单元格；重复检测和上传在生成结束后串行执行。
+
+    Args:
+        cells (int): 待生成的图片数量
+        history (dict): summarize_history 的结果
+        upload_mbps (float): 上传速度（MB/s）
+        deadline_hours (float, optional): 期望的完成时间（小时），指定时推荐满足该时间的最少后端数量
+
+    Returns:
+        dict: 计划详情
+    """
+    seconds_per_cell = history['seconds_per_image'] + history['save_seconds_per_image']
+    output_bytes = cells * history['bytes_per_image']
+    upload_bytes = output_bytes * (1 - history['duplicate_ratio'])
+    upload_seconds = upload_bytes / (upload_mbps * 1024 * 1024) if upload_mbps else 0.0
+    dedup_seconds = cells * history['dedup_seconds_per_image']
+    serial_seconds = dedup_seconds + upload_seconds
+
+    def wall_seconds(backends):
+        return math.ceil(cells / backends) * seconds_per_cell + serial_seconds
+
+    # 后端数量超过单元格数量没有意义
+    max_backends = max(1, min(PLANNER_MAX_BACKENDS, cells))
+
+    if cells == 0:
+        recommended = 1
+        reason = "没有待生成的图片"
+    elif deadline_hours:
+        feasible = [k for k in range(1, max_backends + 1) if wall_seconds(k) <= deadline_hours * 3600]
+        if feasible:
+            recommended = feasible[0]
+            reason = f"满足 {deadline_hours:g} 小时内完成的最少后端数量"
+        else:
+            recommended = max_backends
+            reason = f"{max_backends} 个后端也无法在 {deadline_hours:g} 小时内完成，建议拆分扫描"
+    elif serial_seconds:
+        # 生成时间缩短到与串行的检测和上传相当后，继续增加后端的收益很小
+        recommended = min(max_backends, math.ceil(cells * seconds_per_cell / serial_seconds))
+        reason = "生成耗时降到与重复检测和上传相当，继续增加后端收益很小"
+    else:
+        recommended = min(max_backends, len(API_BACKENDS))
+        reason = "没有上传与检测的耗时记录，按配置中的后端数量"
+
+    counts = sorted({k for k in BACKEND_COUNTS if k <= max_backends}
+                    | {min(len(API_BACKENDS), max_backends), recommended})
+    return {
+        'cells': cells,
+        'history': history,
+        'seconds_per_cell': seconds_per_cell,
+        'gpu_hours': cells * history['seconds_per_image'] / 3600,
+        'output_bytes': int(output_bytes),
+        'upload_bytes': int(upload_bytes),
+        'upload_mbps': upload_mbps,
+        'upload_seconds': upload_seconds,
+        'dedup_seconds': dedup_seconds,
+        'backends': [{
+            'backends': k,
+            'cells_per_backend': math.ceil(cells / k),
+            'wall_seconds': wall_seconds(k)
+        } for k in counts],
+        'recommended_backends': recommended,
+        'recommended_cells_per_backend': math.ceil(cells / recommended),
+        'reason': reason
+    }
+
+
+def format_bytes(size):
+    """把字节数格式化为易读的字符串"""
+    for unit in ['B', 'KB', 'MB', 'GB']:
+        if size < 1024:
+            return f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} TB"
+
+
+def format_duration(seconds):
+    """把秒数格式化为“x小时y分”"""
+    minutes = int(round(seconds / 60))
+    if minutes < 1:
+        return f"{seconds:.0f}秒"
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}小时{minutes}分" if hours else f"{minutes}分"
+
+
+def format_plan(plan, upload_source=None):
+    """把计划格式化为文本行"""
+    history = plan['history']
+    if history['batches']:
+        source = (f"最近 {history['batches']} 个批次（{history['timed_batches']} 个有阶段耗时记录，"
+                  f"{history['estimated_batches']} 个按记录间隔估算）")
+    else:
+        source = "没有历史批次，使用配置中的默认值"
+    lines = [
+        f"\n试运行计划：{plan['cells']} 张图片",
+        f"  历史数据: {source}",
+        f"  单张生成 {history['seconds_per_image']:.1f} 秒，保存 {history['save_seconds_per_image']:.2f} 秒，"
+        f"平均大小 {format_bytes(history['bytes_per_image'])}，重复率 {history['duplicate_ratio']:.1%}",
+        f"  GPU 时长: {plan['gpu_hours']:.2f} 小时",
+        f"  输出大小: {format_bytes(plan['output_bytes'])}（跳过重复后上传 {format_bytes(plan['upload_bytes'])}）",
+        f"  上传耗时: {format_duration(plan['upload_seconds'])}（{plan['upload_mbps']:.1f} MB/s，"
+        f"来源: {upload_source or '默认值'}）",
+        f"  重复检测: {format_duration(plan['dedup_seconds'])}",
+        f"\n  {'后端数量':<8}{'每个后端':<10}预计总耗时"
+    ]
+    for row in plan['backends']:
+        marker = ' *' if row['backends'] == plan['recommended_backends'] else ''
+        lines.append(f"  {row['backends']:<12}{row['cells_per_backend']:<14}{format_duration(row['wall_seconds'])}{marker}")
+    lines.append(f"\n推荐: {plan['recommended_backends']} 个后端，每个后端约 {plan['recommended_cells_per_backend']} 张"
+                 f"（{plan['reason']}）")
+    return lines
+
+
+def build_plan(cells, deadline_hours=None, batch_root=BATCH_ROOT, history_batches=PLANNER_HISTORY_BATCHES,
+               results_dir=PLANNER_BENCH_RESULTS_DIR):
+    """读取历史记录并生成计划，返回 (计划, 上传速度来源)"""
+    histories = [read_batch_history(batch_dir) for batch_dir in list_history_batches(batch_root, history_batches)]
+    upload_mbps, upload_source = load_upload_throughput(results_dir)
+    return plan_sweep(cells, summarize_history(histories), upload_mbps, deadline_hours), upload_source
+
+
+def print_plan(cells, deadline_hours=None):
+    """输出试运行计划，供 batch_generate.py --dry-run 调用"""
+    plan, upload_source = build_plan(cells, deadline_hours)
+    print('\n'.join(format_plan(plan, upload_source)))
+    return plan
+
+
+def main():
+    parser = argparse.ArgumentParser(description='根据历史批次估算一次扫描的耗时与存储')
+    parser.add_argument('--cells', type=int, required=True, help='待生成的图片数量（艺术家数×提示词数）')
+    parser.add_argument('--deadline', type=float, metavar='HOURS', help='期望的完成时间（小时）')
+    parser.add_argument('--batch-root', type=str, default=BATCH_ROOT, help='历史批次的根目录')
+    parser.add_argument('--history', type=int, default=PLANNER_HISTORY_BATCHES, help='参考最近多少个批次')
+    parser.add_argument('--json', type=str, help='把计划写入指定 JSON 文件')
+    args = parser.parse_args()
+
+    plan, upload_source = build_plan(args.cells, args.deadline, args.batch_root, args.history)
+    print('\n'.join(format_plan(plan, upload_source)))
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(dict(plan, upload_source=upload_source), f, ensure_ascii=False, indent=2)
+        print(f"计划已保存到: {args.json}")
+
+
+if __name__ == '__main__':
+    main()
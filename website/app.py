@@ -1,13 +1,21 @@
-from flask import Flask, render_template, send_from_directory, abort, url_for
+from flask import Flask, render_template, stream_template, send_file, abort, url_for, request, Response
+from werkzeug.security import safe_join
+import tempfile
 import sqlite3
+import zlib
+import mimetypes
 from datetime import datetime, timedelta
 import shutil
 from pathlib import Path
 import json
 import os
-from web_config import get_batch_config, get_enabled_batches
+import time
+import bisect
+import threading
+from web_config import (get_batch_config, get_enabled_batches, LIVE_BATCHES_ENABLED, LOCAL_IMAGE_FALLBACK,
+                        THUMBNAIL_WIDTH, DERIVATIVE_WIDTHS, IMAGE_OFFLOAD, X_ACCEL_PREFIX)
+from request_timing import init_app as init_request_timing, stage, stream_stage
 from functools import lru_cache
-from contextlib import contextmanager
 from typing import Optional, Tuple, Dict, List
 
 # 缓存版本号，当缓存结构发生变化时递增
@@ -15,26 +23,27 @@ CACHE_VERSION = 1
 # 缓存过期时间（秒）
 CACHE_EXPIRE_TIME = 24 * 60 * 60  # 24小时
 
-app = Flask(__name__)
+# 批次页面流式渲染配置
+STREAM_BATCH_PAGE = os.getenv('SD_STREAM_BATCH_PAGE', '1') == '1'  # 默认开启，可用 ?stream=0 临时关闭
+STREAM_FIRST_CHUNK_SIZE = 4 * 1024  # 首块尽快发送，让浏览器提前解析页头
+STREAM_CHUNK_SIZE = 64 * 1024  # 后续每块的大小
+STREAM_GZIP = os.getenv('SD_STREAM_GZIP', '1') == '1'  # 客户端支持时边渲染边压缩
+STREAM_GZIP_LEVEL = 6
 
-# 创建数据库连接池
-class DatabasePool:
-    def __init__(self):
-        self._connections = {}
-        
-    @contextmanager
-    def get_connection(self, db_path: str):
-        if db_path not in self._connections:
-            self._connections[db_path] = sqlite3.connect(db_path)
-        try:
-            yield self._connections[db_path]
-        except Exception as e:
-            if db_path in self._connections:
-                self._connections[db_path].close()
-                del self._connections[db_path]
-            raise e
+# 图片文件缓存配置：文件名在批次内唯一且不会被改写，可视为不可变内容
+IMAGE_MAX_AGE = 365 * 24 * 60 * 60  # 一年
+IMAGE_ROOT = Path('static') / 'generate_images' / 'batch'
+DERIVATIVE_ROOT = Path('static') / 'cache' / 'derivatives'
 
-db_pool = DatabasePool()
+# 生成中批次的实时更新配置
+LIVE_REFRESH_INTERVAL = 1.0  # 两次读取数据库新记录的最小间隔（秒）
+LIVE_STREAM_MAX_SECONDS = 300  # 单个SSE连接的最长时间，到期后浏览器会自动重连
+LIVE_HEARTBEAT_SECONDS = 15  # 没有新图片时发送心跳，防止代理断开连接
+
+app = Flask(__name__)
+app.config['USE_X_SENDFILE'] = IMAGE_OFFLOAD == 'x-sendfile'
+# 可选的请求耗时统计（通过 SD_REQUEST_TIMING=1 开启）
+init_request_timing(app)
 
 def ensure_directory_exists(path):
     """确保目录存在，如果不存在则创建"""
@@ -161,64 +170,221 @@ def get_all_batches():
     
     return sorted(batches, key=lambda x: x["name"], reverse=True)
 
+class LiveMatrix:
+    """常驻内存的批次矩阵，按rowid增量读取新记录而不是整体重建
+    
+    R2映射中缺少的图片回退到本地文件（生成中的批次总是回退，
+    其他批次由 LOCAL_IMAGE_FALLBACK 控制），表格中使用本地缩略图。
+    """
+    def __init__(self, batch_name: str, live: bool = False):
+        self.batch_name = batch_name
+        self.live = live
+        self.batch_path = Path('static') / 'generate_images' / 'batch' / batch_name
+        self.db_path = self.batch_path / 'image_generation.db'
+        self.r2_mapping_path = self.batch_path / 'r2_url_mapping.json'
+        self.matrix: Dict[str, Dict[str, Optional[str]]] = {}
+        self.artists: List[str] = []
+        self.prompts: List[str] = []
+        self.paths: Dict[Tuple[str, str], str] = {}
+        self.rowids: List[int] = []
+        self.cells: List[Tuple[str, str]] = []
+        self.last_rowid = 0
+        self.r2_mapping: Dict[str, str] = {}
+        self.mapping_mtime = None
+        self.last_refresh = 0.0
+        self.db_identity = None
+        self.generation = 0
+        self._lock = threading.Lock()
+    
+    def resolve_url(self, image_path: str) -> Optional[str]:
+        """根据R2映射（或本地文件）得到图片地址"""
+        url = self.r2_mapping.get(image_path) or self.r2_mapping.get(Path(image_path).name)
+        if url is None and (self.live or LOCAL_IMAGE_FALLBACK) and (self.batch_path / image_path).exists():
+            url = f"/static/generate_images/batch/{self.batch_name}/{image_path}"
+        return url
+    
+    def _reload_mapping(self) -> bool:
+        """R2映射文件变化时重新加载，返回是否有变化"""
+        mtime = self.r2_mapping_path.stat().st_mtime if self.r2_mapping_path.exists() else None
+        if mtime == self.mapping_mtime:
+            return False
+        with stage('mapping_load'):
+            if mtime is None:
+                self.r2_mapping = {}
+            else:
+                with open(self.r2_mapping_path, 'r', encoding='utf-8') as f:
+                    self.r2_mapping = json.load(f)
+        self.mapping_mtime = mtime
+        return True
+    
+    def _reset(self):
+        """数据库被替换或记录被删除时清空内存矩阵，下次从头读取"""
+        self.matrix = {}
+        self.artists = []
+        self.prompts = []
+        self.paths = {}
+        self.rowids = []
+        self.cells = []
+        self.last_rowid = 0
+        # 已连接的SSE客户端据此得知需要重新加载页面
+        self.generation += 1
+    
+    def _read_new_rows(self):
+        """读取新增记录，同时返回表中的记录总数用于检测删除
+        
+        gthread worker 中多个线程会刷新同一个批次，每次使用短连接，避免跨线程共享sqlite连接。
+        """
+        uri = self.db_path.resolve().as_uri() + '?mode=ro'
+        conn = sqlite3.connect(uri, uri=True, isolation_level=None)
+        try:
+            # 两次查询放在同一个读事务中，看到的是同一份数据
+            conn.execute('BEGIN')
+            count = conn.execute('SELECT COUNT(*) FROM image_records').fetchone()[0]
+            rows = conn.execute('''
+                SELECT id, artist_prompt, prompt_text, image_path
+                FROM image_records WHERE id > ? ORDER BY id
+            ''', (self.last_rowid,)).fetchall()
+            conn.execute('COMMIT')
+        finally:
+            conn.close()
+        return count, rows
+    
+    def refresh(self, force: bool = False) -> bool:
+        """读取新增的记录并修补矩阵，返回矩阵是否有变化"""
+        with self._lock:
+            now = time.monotonic()
+            if not force and now - self.last_refresh < LIVE_REFRESH_INTERVAL:
+                return False
+            self.last_refresh = now
+            
+            mapping_changed = self._reload_mapping()
+            stat = self.db_path.stat()
+            identity = (stat.st_dev, stat.st_ino)
+            with stage('db_query'):
+                count, rows = self._read_new_rows()
+                # 数据库文件被替换（重新生成批次）或有记录被删除时，rowid不再可靠，整体重建
+                if identity != self.db_identity or count != len(self.rowids) + len(rows):
+                    if self.db_identity is not None or self.rowids:
+                        self._reset()
+                        count, rows = self._read_new_rows()
+                    self.db_identity = identity
+                    mapping_changed = True
+            
+            if mapping_changed:
+                # 映射变化只影响地址，用内存中的路径重新解析即可，无需查询数据库
+                for (artist, prompt), image_path in self.paths.items():
+                    self.matrix[artist][prompt] = self.resolve_url(image_path)
+            if not rows:
+                return mapping_changed
+            
+            new_artists = {row[1] for row in rows} - self.matrix.keys()
+            new_prompts = {row[2] for row in rows} - set(self.prompts)
+            if new_prompts:
+                for prompt_row in self.matrix.values():
+                    for prompt in new_prompts:
+                        prompt_row[prompt] = None
+                # 重新赋值而不是原地排序，正在渲染的页面仍使用旧列表
+                self.prompts = sorted(set(self.prompts) | new_prompts, reverse=True)
+            for artist in new_artists:
+                self.matrix[artist] = {prompt: None for prompt in self.prompts}
+            if new_artists:
+                self.artists = sorted(set(self.artists) | new_artists, reverse=True)
+            
+            for rowid, artist, prompt, image_path in rows:
+                self.paths[(artist, prompt)] = image_path
+                self.matrix[artist][prompt] = self.resolve_url(image_path)
+                self.rowids.append(rowid)
+                self.cells.append((artist, prompt))
+            self.last_rowid = rows[-1][0]
+            return True
+    
+    def cells_since(self, rowid: int) -> List[Tuple[int, str, str, Optional[str]]]:
+        """返回rowid之后新增的单元格 (rowid, artist, prompt, url)"""
+        with self._lock:
+            start = bisect.bisect_right(self.rowids, rowid)
+            return [(self.rowids[i], *self.cells[i], self.matrix[self.cells[i][0]][self.cells[i][1]])
+                    for i in range(start, len(self.rowids))]
+    
+    def snapshot(self, copy: bool = False):
+        """返回 (matrix, artists, prompts)；copy=True 时在锁内复制，供序列化等需要遍历的场景使用
+        
+        三个引用在锁内一起读取，避免在重建过程中拿到旧的艺术家列表和新的矩阵。
+        """
+        with self._lock:
+            if not copy:
+                return self.matrix, self.artists, self.prompts
+            return {artist: dict(row) for artist, row in self.matrix.items()}, list(self.artists), list(self.prompts)
+    
+    def event_id(self) -> str:
+        """当前位置的SSE事件id "<generation>:<rowid>"，矩阵重建后旧id中的generation不再匹配"""
+        with self._lock:
+            return f"{self.generation}:{self.last_rowid}"
+
+def parse_event_id(value: Optional[str]) -> Tuple[Optional[int], int]:
+    """解析 "<generation>:<rowid>" 形式的事件id，只有rowid时generation为None"""
+    generation, _, rowid = (value or '').rpartition(':')
+    try:
+        return (int(generation) if generation else None), int(rowid or 0)
+    except ValueError:
+        return None, 0
+
+# 每个worker进程内的批次矩阵
+live_matrices: Dict[str, LiveMatrix] = {}
+live_matrices_lock = threading.Lock()
+
+def get_live_matrix(batch_name: str, live: bool = False) -> Optional[LiveMatrix]:
+    """获取（必要时创建）批次的内存矩阵并刷新"""
+    with live_matrices_lock:
+        state = live_matrices.get(batch_name)
+        if state is None:
+            state = LiveMatrix(batch_name, live=live)
+            if not state.db_path.exists():
+                return None
+            live_matrices[batch_name] = state
+    state.live = state.live or live
+    state.refresh()
+    return state
+
 def get_matrix_data(batch_name):
     """获取指定批次的矩阵式组织的图片数据"""
-    if is_cache_valid(batch_name):
-        return load_matrix_cache(batch_name)
+    # 已在内存中的批次只增量读取新记录
+    state = live_matrices.get(batch_name)
+    if state is not None:
+        with stage('incremental_refresh'):
+            if state.refresh():
+                save_matrix_cache(batch_name, *state.snapshot(copy=True))
+        return state.snapshot()
+    
+    with stage('cache_validate'):
+        cache_valid = is_cache_valid(batch_name)
+    if cache_valid:
+        with stage('cache_load'):
+            return load_matrix_cache(batch_name)
     
     batch_path = Path('static') / 'generate_images' / 'batch' / batch_name
     db_path = batch_path / 'image_generation.db'
     r2_mapping_path = batch_path / 'r2_url_mapping.json'
     
-    if not db_path.exists() or not r2_mapping_path.exists():
+    if not db_path.exists() or (not r2_mapping_path.exists() and not LOCAL_IMAGE_FALLBACK):
         return None, None, None
     
     try:
-        # 加载R2 URL映射
-        with open(r2_mapping_path, 'r', encoding='utf-8') as f:
-            r2_mapping = json.load(f)
+        state = get_live_matrix(batch_name)
+        # 其他线程可能同时在刷新同一个批次，保存缓存前先复制
+        matrix, artists, prompts = state.snapshot(copy=True)
+        match_count = sum(1 for row in matrix.values() for url in row.values() if url)
+        print(f"总共找到 {match_count} 个匹配的图片URL")
         
-        # 数据库操作
-        with db_pool.get_connection(str(db_path)) as conn:
-            cursor = conn.cursor()
-            
-            # 获取所有不同的艺术家和提示词
-            cursor.execute('SELECT DISTINCT artist_prompt FROM image_records ORDER BY artist_prompt DESC')
-            artists = [row[0] for row in cursor.fetchall()]
-            
-            cursor.execute('SELECT DISTINCT prompt_text FROM image_records ORDER BY prompt_text DESC')
-            prompts = [row[0] for row in cursor.fetchall()]
-            
-            # 使用单个SQL查询获取所有数据
-            cursor.execute('''
-                SELECT artist_prompt, prompt_text, image_path 
-                FROM image_records 
-                WHERE artist_prompt IN ({}) AND prompt_text IN ({})
-            '''.format(
-                ','.join('?' * len(artists)),
-                ','.join('?' * len(prompts))
-            ), artists + prompts)
-            
-            # 创建矩阵
-            matrix = {artist: {prompt: None for prompt in prompts} for artist in artists}
-            match_count = 0
-            
-            # 填充矩阵
-            for artist_prompt, prompt_text, image_path in cursor.fetchall():
-                url = r2_mapping.get(image_path) or r2_mapping.get(Path(image_path).name)
-                if url:
-                    matrix[artist_prompt][prompt_text] = url
-                    match_count += 1
-            
-            print(f"总共找到 {match_count} 个匹配的图片URL")
-            
-            # 保存到缓存
+        # 保存到缓存
+        with stage('cache_save'):
             save_matrix_cache(batch_name, matrix, artists, prompts)
-            
-            return matrix, artists, prompts
+        
+        return matrix, artists, prompts
             
     except Exception as e:
         print(f"处理数据时出错: {e}")
+        with live_matrices_lock:
+            live_matrices.pop(batch_name, None)
         return None, None, None
 
 @app.route('/')
@@ -226,29 +392,156 @@ def home():
     batches = get_all_batches()
     return render_template('index.html', batches=batches)
 
+def iter_chunks(fragments, first_size=STREAM_FIRST_CHUNK_SIZE, chunk_size=STREAM_CHUNK_SIZE):
+    """把模板逐段产出的小字符串合并为较大的字节块，第一块使用较小的阈值以便尽早发送"""
+    buffer = []
+    buffered = 0
+    threshold = first_size
+    for fragment in fragments:
+        data = fragment.encode('utf-8')
+        buffer.append(data)
+        buffered += len(data)
+        if buffered >= threshold:
+            yield b''.join(buffer)
+            buffer = []
+            buffered = 0
+            threshold = chunk_size
+    if buffer:
+        yield b''.join(buffer)
+
+def gzip_chunks(chunks, level=STREAM_GZIP_LEVEL):
+    """逐块gzip压缩，每块后做同步刷新，保证浏览器能立即解压已收到的部分"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        if data:
+            yield data
+    yield compressor.flush()
+
+def should_stream_batch_page():
+    """是否以流式方式返回批次页面，?stream=0/1 可覆盖默认配置"""
+    override = request.args.get('stream')
+    if override is not None:
+        return override != '0'
+    return STREAM_BATCH_PAGE
+
+def stream_batch_page(**context):
+    """流式渲染批次页面：页头和前几行立即发送，其余行分块发送"""
+    # 渲染与发送交替进行，template_render 记录的是整个页面流完所用的时间
+    chunks = stream_stage('template_render', iter_chunks(stream_template('batch.html', **context)))
+    headers = {
+        # 防止nginx等反向代理缓冲整个响应
+        'X-Accel-Buffering': 'no',
+        'Vary': 'Accept-Encoding'
+    }
+    if STREAM_GZIP and 'gzip' in request.accept_encodings:
+        chunks = gzip_chunks(chunks)
+        headers['Content-Encoding'] = 'gzip'
+    return Response(chunks, mimetype='text/html', headers=headers)
+
+def render_batch_page(matrix, artists, prompts, batch_name, display_name, config, events_url=None, last_event_id=0):
+    """渲染批次页面，events_url不为空时页面会订阅实时更新"""
+    context = dict(matrix=matrix, 
+                   artists=artists, 
+                   prompts=prompts, 
+                   batch_name=batch_name,
+                   display_name=display_name,
+                   config=config,
+                   events_url=events_url,
+                   last_event_id=last_event_id,
+                   thumbnail_width=THUMBNAIL_WIDTH)
+    if should_stream_batch_page():
+        return stream_batch_page(**context)
+    
+    with stage('template_render'):
+        return render_template('batch.html', **context)
+
+def find_batch_by_url_path(url_path):
+    """根据自定义URL查找已启用的批次，返回 (批次名, 配置)"""
+    for batch_path, config in get_enabled_batches().items():
+        if config["url_path"] == url_path:
+            return batch_path.split("/")[-1], config
+    return None, None
+
 @app.route('/batch/<url_path>')
 def show_batch(url_path):
     # 查找对应的原始批次路径
-    for batch_path, config in get_enabled_batches().items():
-        if config["url_path"] == url_path:
-            batch_name = batch_path.split("/")[-1]
-            matrix, artists, prompts = get_matrix_data(batch_name)
-            
-            # 如果没有数据，返回错误信息
-            if matrix is None or artists is None or prompts is None:
-                return render_template('error.html', 
-                                    message="此批次的图片尚未上传到图床，请先运行上传脚本。",
-                                    back_url=url_for('home'))
-            
-            return render_template('batch.html', 
-                                matrix=matrix, 
-                                artists=artists, 
-                                prompts=prompts, 
-                                batch_name=batch_name,
-                                display_name=config["display_name"],
-                                config=config)
+    batch_name, config = find_batch_by_url_path(url_path)
+    if batch_name is None:
+        abort(404)  # 如果找不到对应的批次，返回404错误
+    
+    if config.get("live", False):
+        return show_live_batch(batch_name)
+    
+    matrix, artists, prompts = get_matrix_data(batch_name)
     
-    abort(404)  # 如果找不到对应的批次，返回404错误
+    # 如果没有数据，返回错误信息
+    if matrix is None or artists is None or prompts is None:
+        return render_template('error.html', 
+                            message="此批次的图片尚未上传到图床，请先运行上传脚本。",
+                            back_url=url_for('home'))
+    
+    return render_batch_page(matrix, artists, prompts, batch_name, config["display_name"], config)
+
+def get_live_batch_state(batch_name):
+    """获取生成中批次的内存矩阵，批次名不合法或不存在时返回404"""
+    if batch_name != Path(batch_name).name or batch_name.startswith('.'):
+        abort(404)
+    if not LIVE_BATCHES_ENABLED and not get_batch_config(f"batch/{batch_name}").get("live", False):
+        abort(404)
+    with stage('incremental_refresh'):
+        state = get_live_matrix(batch_name, live=True)
+    if state is None:
+        abort(404)
+    return state
+
+@app.route('/live/<batch_name>')
+def show_live_batch(batch_name):
+    """实时查看生成中的批次，新图片通过SSE推送到页面
+
+    配置了 "live": True 的批次可以访问；开启 LIVE_BATCHES_ENABLED 后任意批次都可以访问。
+    """
+    state = get_live_batch_state(batch_name)
+    config = get_batch_config(f"batch/{batch_name}")
+    display_name = config["display_name"] if config.get("enabled") else f"{batch_name}（生成中）"
+    # 先记下事件id再取矩阵，渲染期间新增的单元格会通过SSE补发，期间矩阵被重建时页面会重新加载
+    last_event_id = state.event_id()
+    matrix, artists, prompts = state.snapshot()
+    return render_batch_page(matrix, artists, prompts, batch_name, display_name, config,
+                             events_url=url_for('live_batch_events', batch_name=batch_name),
+                             last_event_id=last_event_id)
+
+@app.route('/live/<batch_name>/events')
+def live_batch_events(batch_name):
+    """以server-sent events推送新生成的单元格"""
+    state = get_live_batch_state(batch_name)
+    # 页面和断线重连都会带上客户端所见的generation，与当前矩阵不一致时要求页面重新加载
+    generation, after = parse_event_id(request.headers.get('Last-Event-ID') or request.args.get('after'))
+    if generation is None:
+        generation = state.generation
+    
+    def generate(after):
+        deadline = time.monotonic() + LIVE_STREAM_MAX_SECONDS
+        last_sent = time.monotonic()
+        yield 'retry: 3000\n\n'
+        while time.monotonic() < deadline:
+            state.refresh()
+            if state.generation != generation:
+                # 批次被重新生成或记录被删除，rowid已不可靠，让页面重新加载
+                yield 'event: reload\ndata: {}\n\n'
+                return
+            for rowid, artist, prompt, url in state.cells_since(after):
+                payload = json.dumps({'artist': artist, 'prompt': prompt, 'url': url}, ensure_ascii=False)
+                yield f'id: {generation}:{rowid}\nevent: cell\ndata: {payload}\n\n'
+                after = rowid
+                last_sent = time.monotonic()
+            if time.monotonic() - last_sent >= LIVE_HEARTBEAT_SECONDS:
+                yield ': keepalive\n\n'
+                last_sent = time.monotonic()
+            time.sleep(LIVE_REFRESH_INTERVAL)
+    
+    return Response(generate(after), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-store', 'X-Accel-Buffering': 'no'})
 
 @app.after_request
 def add_header(response):
@@ -257,14 +550,79 @@ def add_header(response):
         response.headers['Cache-Control'] = 'no-store'
     return response
 
+def get_file_etag(stat: os.stat_result) -> str:
+    """以修改时间和大小生成ETag（与nginx相同的做法），无需读取文件内容"""
+    return f"{stat.st_mtime_ns:x}-{stat.st_size:x}"
+
+@lru_cache(maxsize=4096)
+def get_image_width(file_path: str, mtime_ns: int) -> int:
+    """读取图片宽度，以修改时间为缓存键，避免对小于目标宽度的原图每次请求都重新打开"""
+    from PIL import Image
+    with Image.open(file_path) as image:
+        return image.width
+
+def get_derivative(source: Path, relative: str, width: int) -> Path:
+    """获取（必要时生成）指定宽度的缩略图，未安装Pillow时返回原图"""
+    target = DERIVATIVE_ROOT / f"w{width}" / Path(relative).with_suffix('.webp')
+    source_stat = source.stat()
+    if target.exists() and target.stat().st_mtime >= source_stat.st_mtime:
+        return target
+    try:
+        from PIL import Image
+    except ImportError:
+        return source
+    # 原图不比目标宽度大时直接返回原图，判断结果按修改时间缓存
+    if get_image_width(str(source), source_stat.st_mtime_ns) <= width:
+        return source
+    ensure_directory_exists(target.parent)
+    with Image.open(source) as image:
+        height = round(image.height * width / image.width)
+        thumbnail = image.convert('RGB').resize((width, height), Image.LANCZOS)
+        # 先写入临时文件再替换，避免并发请求读到不完整的文件
+        fd, temp_path = tempfile.mkstemp(dir=target.parent, suffix='.webp')
+        with os.fdopen(fd, 'wb') as f:
+            thumbnail.save(f, format='webp', quality=85)
+        os.replace(temp_path, target)
+    return target
+
+def send_image_file(path: Path):
+    """以修改时间和大小作为ETag、配合不可变缓存发送图片，支持Range和If-None-Match，可交给前端服务器发送"""
+    stat = path.stat()
+    etag = get_file_etag(stat)
+    
+    if IMAGE_OFFLOAD == 'x-accel':
+        # path 来自 safe_join 校验后的 IMAGE_ROOT 或 DERIVATIVE_ROOT 下的路径，按字面计算相对路径；
+        # 不能先 resolve，批次目录是指向其他磁盘的符号链接时真实路径不在 static 下
+        relative = path.relative_to('static').as_posix()
+        response = Response(mimetype=mimetypes.guess_type(path.name)[0] or 'application/octet-stream')
+        response.headers['X-Accel-Redirect'] = f"{X_ACCEL_PREFIX}/{relative}"
+        response.set_etag(etag)
+        response.last_modified = stat.st_mtime
+        # Range由nginx处理，这里只处理条件请求
+        response.make_conditional(request, accept_ranges=False)
+    else:
+        # USE_X_SENDFILE开启时send_file只返回X-Sendfile头
+        response = send_file(path.resolve(), conditional=True, etag=etag, max_age=IMAGE_MAX_AGE)
+    
+    response.headers['Cache-Control'] = f'public, max-age={IMAGE_MAX_AGE}, immutable'
+    response.headers['Expires'] = (datetime.utcnow() + timedelta(seconds=IMAGE_MAX_AGE)).strftime('%a, %d %b %Y %H:%M:%S GMT')
+    return response
+
 @app.route('/static/generate_images/batch/<path:filename>')
 def serve_image(filename):
-    """专门处理图片文件的路由，添加缓存控制"""
-    response = send_from_directory('static/generate_images/batch', filename)
-    # 设置缓存时间为30天
-    response.headers['Cache-Control'] = 'public, max-age=2592000'
-    response.headers['Expires'] = (datetime.utcnow() + timedelta(days=30)).strftime('%a, %d %b %Y %H:%M:%S GMT')
-    return response
+    """专门处理图片文件的路由，?w=宽度 返回缩略图"""
+    joined = safe_join(str(IMAGE_ROOT), filename)
+    if joined is None or not os.path.isfile(joined):
+        abort(404)
+    path = Path(joined)
+    
+    width = request.args.get('w', type=int)
+    if width is not None:
+        if width not in DERIVATIVE_WIDTHS:
+            abort(400)
+        path = get_derivative(path, filename, width)
+    
+    return send_image_file(path)
 
 if __name__ == '__main__':
     app.run(debug=True) 
\ No newline at end of file
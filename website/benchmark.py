@@ -0,0 +1,559 @@
+"""
+网站与上传流程的基准测试脚本
+
+使用合成的批次数据（假数据库 + 假 R2 映射文件）测量：
+- get_matrix_data 冷/热缓存延迟
+- batch.html 渲染耗时与 HTML 大小
+- gunicorn 在并发客户端下的每秒请求数
+- 针对本地 S3 替身（moto / MinIO）的上传吞吐量
+- 命令行入口的启动耗时（--help、试运行、查看进度），并用 -X importtime 列出最慢的导入
+
+结果保存为 JSON，便于在不同提交之间对比性能回归。
+
+示例：
+    python benchmark.py --sizes 100,1000 --prompts 4
+    python benchmark.py --only matrix,render --compare bench_results/上一次.json
+    python benchmark.py --only importtime --sizes 100
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import socket
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+
+# 基准测试配置
+BENCH_DIR = Path(__file__).resolve().parent
+GENERATION_DIR = BENCH_DIR.parent / 'image_genration'
+RESULTS_DIR = BENCH_DIR / 'bench_results'
+DEFAULT_SIZES = [100, 1000, 10000]
+DEFAULT_PROMPTS = 4
+DEFAULT_REPEAT = 5
+DEFAULT_CLIENTS = 8
+DEFAULT_REQUESTS = 200
+DEFAULT_UPLOAD_IMAGES = 200
+FAKE_IMAGE_SIZE = 64 * 1024  # 每张假图片的字节数
+FAKE_URL_PREFIX = "https://bench.invalid"
+# 回归判定阈值：比上一次结果慢超过该比例时标记
+REGRESSION_THRESHOLD = 0.10
+ALL_BENCHMARKS = ['matrix', 'render', 'gunicorn', 'upload', 'importtime']
+# 调度器会频繁调用的命令行入口，启动耗时目标（毫秒）
+STARTUP_TARGET_MS = 200
+# (名称, 工作目录, 参数)，{batch} 会替换为合成批次目录
+STARTUP_COMMANDS = [
+    ('batch_generate_help', GENERATION_DIR, ['batch_generate.py', '--help']),
+    ('batch_generate_dry_run', GENERATION_DIR, ['batch_generate.py', '--artists', 'artist_strings_single_unique.csv',
+                                                '--prompts', 'prompt_string.csv', '--dry-run']),
+    ('batch_generate_status', GENERATION_DIR, ['batch_generate.py', '--status', '{batch}', '--artists',
+                                               'artist_strings_single_unique.csv', '--prompts', 'prompt_string.csv']),
+    ('job_queue_help', GENERATION_DIR, ['job_queue.py', '--help']),
+    ('image_dedup_help', GENERATION_DIR, ['image_dedup.py', '--help']),
+    ('generation_cache_help', GENERATION_DIR, ['generation_cache.py', '--help']),
+    ('upload_to_r2_help', BENCH_DIR, ['upload_to_r2.py', '--help']),
+    ('clear_r2_help', BENCH_DIR, ['clear_r2.py', '--help']),
+]
+
+
+def bench_batch_name(artist_count, prompt_count):
+    """合成批次的名称"""
+    return f"bench-{artist_count}x{prompt_count}"
+
+
+def create_synthetic_batch(root, artist_count, prompt_count, with_images=False):
+    """在 root/static/generate_images/batch 下生成一个合成批次
+
+    Args:
+        root (Path): 作为工作目录的根路径
+        artist_count (int): 艺术家数量
+        prompt_count (int): 提示词数量
+        with_images (bool): 是否同时写出假图片文件（上传测试需要）
+
+    Returns:
+        Path: 批次目录
+    """
+    batch_name = bench_batch_name(artist_count, prompt_count)
+    batch_path = root / 'static' / 'generate_images' / 'batch' / batch_name
+    if batch_path.exists():
+        shutil.rmtree(batch_path)
+    batch_path.mkdir(parents=True)
+
+    rng = random.Random(artist_count * 1000 + prompt_count)
+    artists = [f"artist_{i:05d},[style_{rng.randint(0, 999)}]" for i in range(artist_count)]
+    prompts = [f"1girl,solo,scene_{j},{rng.choice(['indoor', 'outdoor', 'night'])}" for j in range(prompt_count)]
+
+    conn = sqlite3.connect(str(batch_path / 'image_generation.db'))
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS image_records (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        image_path TEXT NOT NULL,
+        artist_file TEXT NOT NULL,
+        artist_prompt TEXT NOT NULL,
+        prompt_file TEXT NOT NULL,
+        prompt_text TEXT NOT NULL,
+        combined_prompt TEXT NOT NULL,
+        generation_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''')
+
+    url_mapping = {}
+    rows = []
+    payload = os.urandom(FAKE_IMAGE_SIZE) if with_images else None
+    index = 0
+    for artist in artists:
+        for prompt in prompts:
+            image_path = f"image_{index:08d}_0.webp"
+            rows.append((image_path, 'bench_artists.csv', artist, 'bench_prompts.csv', prompt, f"{artist},{prompt}"))
+            url_mapping[image_path] = f"{FAKE_URL_PREFIX}/{batch_name}/{image_path}"
+            if payload is not None:
+                (batch_path / image_path).write_bytes(payload)
+            index += 1
+
+    conn.executemany('''
+    INSERT INTO image_records (image_path, artist_file, artist_prompt, prompt_file, prompt_text, combined_prompt)
+    VALUES (?, ?, ?, ?, ?, ?)
+    ''', rows)
+    conn.commit()
+    conn.close()
+
+    with open(batch_path / 'r2_url_mapping.json', 'w', encoding='utf-8') as f:
+        json.dump(url_mapping, f, ensure_ascii=False)
+
+    return batch_path
+
+
+def register_bench_batch(batch_name):
+    """把合成批次注册到显示配置中，返回其 url_path"""
+    import web_config
+    url_path = batch_name
+    web_config.BATCH_DISPLAY_CONFIG[f"batch/{batch_name}"] = {
+        "display_name": f"Benchmark {batch_name}",
+        "url_path": url_path,
+        "enabled": True,
+        "civitai_url": "",
+        "huggingface_url": ""
+    }
+    return url_path
+
+
+def create_bench_app(batch_names):
+    """gunicorn 使用的应用工厂，注册逗号分隔的合成批次后返回 Flask 应用"""
+    for batch_name in batch_names.split(','):
+        register_bench_batch(batch_name)
+    from app import app
+    return app
+
+
+def summarize(samples):
+    """把耗时样本（秒）汇总为毫秒统计"""
+    ordered = sorted(samples)
+    p95_index = min(len(ordered) - 1, int(round(0.95 * (len(ordered) - 1))))
+    return {
+        "min_ms": round(ordered[0] * 1000, 3),
+        "median_ms": round(statistics.median(ordered) * 1000, 3),
+        "p95_ms": round(ordered[p95_index] * 1000, 3),
+        "max_ms": round(ordered[-1] * 1000, 3),
+        "samples": len(ordered)
+    }
+
+
+def invalidate_matrix_cache(batch_name):
+    """删除磁盘缓存、内存矩阵并清空 mtime 缓存，模拟冷启动"""
+    import app as web_app
+    cache_path = web_app.get_cache_path(batch_name)
+    if cache_path.exists():
+        cache_path.unlink()
+    web_app.get_file_mtime.cache_clear()
+    web_app.live_matrices.pop(batch_name, None)
+
+
+def bench_matrix(batch_name, repeat):
+    """测量 get_matrix_data 冷/热缓存延迟"""
+    import app as web_app
+    cold, warm = [], []
+    for _ in range(repeat):
+        invalidate_matrix_cache(batch_name)
+        start = time.perf_counter()
+        matrix, _, _ = web_app.get_matrix_data(batch_name)
+        cold.append(time.perf_counter() - start)
+        if matrix is None:
+            raise RuntimeError(f"批次 {batch_name} 的矩阵数据加载失败")
+
+        # 让缓存文件的修改时间晚于数据库，避免同一秒内被判定为过期
+        cache_path = web_app.get_cache_path(batch_name)
+        future = time.time() + 1
+        os.utime(cache_path, (future, future))
+        web_app.get_file_mtime.cache_clear()
+        # 热缓存指新worker从磁盘缓存加载，不含内存中的矩阵
+        web_app.live_matrices.pop(batch_name, None)
+
+        start = time.perf_counter()
+        web_app.get_matrix_data(batch_name)
+        warm.append(time.perf_counter() - start)
+    return {"cold": summarize(cold), "warm": summarize(warm)}
+
+
+def bench_render(url_path, repeat):
+    """测量 batch.html 的首块耗时、完整请求耗时与 HTML 大小"""
+    from app import app
+    client = app.test_client()
+    first_chunk, samples = [], []
+    html_size = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        response = client.get(f"/batch/{url_path}", buffered=False)
+        if response.status_code != 200:
+            raise RuntimeError(f"渲染 /batch/{url_path} 返回 {response.status_code}")
+        chunks = iter(response.response)
+        body = next(chunks, b'')
+        first_chunk.append(time.perf_counter() - start)
+        body += b''.join(chunks)
+        response.close()
+        samples.append(time.perf_counter() - start)
+        html_size = len(body)
+    return {"first_chunk": summarize(first_chunk), "latency": summarize(samples), "html_bytes": html_size}
+
+
+def get_free_port():
+    """获取一个空闲的本地端口"""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_for_port(port, timeout=30):
+    """等待端口可连接"""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=1):
+                return True
+        except OSError:
+            time.sleep(0.2)
+    return False
+
+
+def bench_gunicorn(root, batch_names, url_path, clients, total_requests, workers):
+    """在 gunicorn 下用并发客户端压测批次页面"""
+    port = get_free_port()
+    app_spec = f"benchmark:create_bench_app('{','.join(batch_names)}')"
+    command = [
+        sys.executable, '-m', 'gunicorn',
+        '--chdir', str(root),
+        '--pythonpath', str(BENCH_DIR),
+        '--bind', f"127.0.0.1:{port}",
+        '--workers', str(workers),
+        '--timeout', '300',
+        '--log-level', 'warning',
+        app_spec
+    ]
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    try:
+        if not wait_for_port(port):
+            raise RuntimeError(f"gunicorn 启动失败: {process.stderr.read().decode(errors='replace')}")
+
+        url = f"http://127.0.0.1:{port}/batch/{url_path}"
+        # 预热：让每个 worker 生成一次缓存
+        for _ in range(workers):
+            urllib.request.urlopen(url, timeout=300).read()
+
+        latencies = []
+        errors = []
+        lock = threading.Lock()
+
+        def fetch(_):
+            start = time.perf_counter()
+            try:
+                with urllib.request.urlopen(url, timeout=300) as response:
+                    response.read()
+                elapsed = time.perf_counter() - start
+                with lock:
+                    latencies.append(elapsed)
+            except Exception as e:
+                with lock:
+                    errors.append(str(e))
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=clients) as executor:
+            list(executor.map(fetch, range(total_requests)))
+        wall = time.perf_counter() - start
+
+        return {
+            "workers": workers,
+            "clients": clients,
+            "requests": total_requests,
+            "errors": len(errors),
+            "requests_per_sec": round(len(latencies) / wall, 2) if wall else 0,
+            "latency": summarize(latencies) if latencies else None
+        }
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def start_local_s3():
+    """启动本地 S3 替身（moto），返回 (endpoint, server)；未安装时返回 (None, None)"""
+    try:
+        from moto.server import ThreadedMotoServer
+    except ImportError:
+        return None, None
+    port = get_free_port()
+    server = ThreadedMotoServer(ip_address='127.0.0.1', port=port, verbose=False)
+    server.start()
+    return f"http://127.0.0.1:{port}", server
+
+
+def bench_upload(root, image_count, endpoint):
+    """测量 upload_to_r2.process_batch 对本地 S3 替身的上传吞吐量"""
+    import boto3
+    import upload_to_r2
+
+    server = None
+    if endpoint is None:
+        endpoint, server = start_local_s3()
+        if endpoint is None:
+            return {"skipped": "未提供 --s3-endpoint 且未安装 moto"}
+
+    bucket_name = 'sd-prompts-bench'
+    credentials = {
+        'aws_access_key_id': os.getenv('R2_ACCESS_KEY_ID', 'bench'),
+        'aws_secret_access_key': os.getenv('R2_SECRET_ACCESS_KEY', 'bench'),
+    }
+    try:
+        s3 = boto3.client('s3', endpoint_url=endpoint, region_name='us-east-1', **credentials)
+        try:
+            s3.create_bucket(Bucket=bucket_name)
+        except s3.exceptions.BucketAlreadyOwnedByYou:
+            pass
+
+        # 指向本地替身，并重置全局客户端
+        upload_to_r2.R2_ENDPOINT = endpoint
+        upload_to_r2.R2_BUCKET_NAME = bucket_name
+        upload_to_r2.R2_ACCESS_KEY_ID = credentials['aws_access_key_id']
+        upload_to_r2.R2_SECRET_ACCESS_KEY = credentials['aws_secret_access_key']
+        upload_to_r2.s3_client = None
+        upload_to_r2.r2_bucket = None
+
+        batch_path = create_synthetic_batch(root, image_count, 1, with_images=True)
+        (batch_path / 'r2_url_mapping.json').unlink()
+
+        start = time.perf_counter()
+        upload_to_r2.process_batch(batch_path)
+        wall = time.perf_counter() - start
+
+        with open(batch_path / 'r2_url_mapping.json', 'r', encoding='utf-8') as f:
+            uploaded = len(json.load(f))
+        total_bytes = uploaded * FAKE_IMAGE_SIZE
+        return {
+            "endpoint": endpoint if server is None else "moto",
+            "images": uploaded,
+            "bytes": total_bytes,
+            "seconds": round(wall, 3),
+            "images_per_sec": round(uploaded / wall, 2) if wall else 0,
+            "mb_per_sec": round(total_bytes / wall / 1024 / 1024, 2) if wall else 0
+        }
+    finally:
+        if server is not None:
+            server.stop()
+
+
+def parse_importtime(stderr, top=5):
+    """解析 -X importtime 的输出，返回 (顶层导入总耗时毫秒, 最慢的顶层导入列表)"""
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        parts = line[len('import time:'):].split('|')
+        if len(parts) != 3 or not parts[1].strip().isdigit():
+            continue
+        name = parts[2].rstrip()
+        # 缩进只有一个空格的是顶层导入，其累计耗时已包含所有子模块
+        if len(name) - len(name.lstrip()) == 1:
+            modules.append((name.strip(), int(parts[1]) / 1000))
+    slowest = sorted(modules, key=lambda item: -item[1])[:top]
+    return round(sum(ms for _, ms in modules), 3), [{"module": name, "cumulative_ms": round(ms, 3)}
+                                                   for name, ms in slowest]
+
+
+def bench_importtime(batch_path, repeat):
+    """测量命令行入口的启动耗时，并记录最慢的导入"""
+    results = {}
+    for name, cwd, argv in STARTUP_COMMANDS:
+        argv = [arg.format(batch=batch_path) for arg in argv]
+        samples = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            completed = subprocess.run([sys.executable] + argv, cwd=cwd, stdin=subprocess.DEVNULL,
+                                       capture_output=True, text=True, timeout=60)
+            samples.append(time.perf_counter() - start)
+            if completed.returncode != 0:
+                raise RuntimeError(f"{' '.join(argv)} 退出码 {completed.returncode}: {completed.stderr[-500:]}")
+
+        # -X importtime 本身有额外开销，单独运行一次只用于分析导入
+        completed = subprocess.run([sys.executable, '-X', 'importtime'] + argv, cwd=cwd, stdin=subprocess.DEVNULL,
+                                   capture_output=True, text=True, timeout=60)
+        import_ms, slowest = parse_importtime(completed.stderr)
+        wall = summarize(samples)
+        results[name] = {
+            "wall": wall,
+            "import_ms": import_ms,
+            "slowest_imports": slowest,
+            "over_target": wall["median_ms"] > STARTUP_TARGET_MS
+        }
+    return results
+
+
+def get_git_commit():
+    """获取当前提交的哈希，失败时返回 None"""
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=BENCH_DIR, stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except Exception:
+        return None
+
+
+def flatten_metrics(data, prefix=''):
+    """把嵌套结果展开为 {路径: 数值}，用于对比"""
+    metrics = {}
+    if isinstance(data, dict):
+        for key, value in data.items():
+            metrics.update(flatten_metrics(value, f"{prefix}.{key}" if prefix else key))
+    elif isinstance(data, (int, float)) and not isinstance(data, bool):
+        metrics[prefix] = data
+    return metrics
+
+
+def compare_results(previous, current):
+    """对比两次结果，返回疑似回归的指标列表"""
+    old = flatten_metrics(previous.get('results', {}))
+    new = flatten_metrics(current.get('results', {}))
+    regressions = []
+    for key, new_value in new.items():
+        old_value = old.get(key)
+        if not old_value or key.endswith('samples'):
+            continue
+        # 吞吐量类指标越大越好，其余（耗时、大小）越小越好
+        higher_is_better = key.endswith('_per_sec')
+        change = (new_value - old_value) / old_value
+        if (higher_is_better and change < -REGRESSION_THRESHOLD) or \
+           (not higher_is_better and key.endswith('_ms') and change > REGRESSION_THRESHOLD):
+            regressions.append({"metric": key, "previous": old_value, "current": new_value,
+                                "change": round(change * 100, 1)})
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='网站与上传流程的基准测试')
+    parser.add_argument('--sizes', type=str, default=','.join(map(str, DEFAULT_SIZES)),
+                        help='逗号分隔的艺术家数量，例如：100,1000,10000')
+    parser.add_argument('--prompts', type=int, default=DEFAULT_PROMPTS, help='每个艺术家的提示词数量')
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT, help='每项测试重复次数')
+    parser.add_argument('--only', type=str, default=','.join(ALL_BENCHMARKS),
+                        help=f"逗号分隔的测试项，可选：{','.join(ALL_BENCHMARKS)}")
+    parser.add_argument('--clients', type=int, default=DEFAULT_CLIENTS, help='gunicorn 压测的并发客户端数')
+    parser.add_argument('--requests', type=int, default=DEFAULT_REQUESTS, help='gunicorn 压测的总请求数')
+    parser.add_argument('--workers', type=int, default=4, help='gunicorn worker 数量')
+    parser.add_argument('--upload-images', type=int, default=DEFAULT_UPLOAD_IMAGES, help='上传测试的图片数量')
+    parser.add_argument('--s3-endpoint', type=str, help='本地 S3 替身地址，默认自动启动 moto')
+    parser.add_argument('--output', type=str, help='结果 JSON 路径，默认写入 bench_results/')
+    parser.add_argument('--compare', type=str, help='与之前的结果 JSON 对比并列出回归')
+    args = parser.parse_args()
+
+    sizes = [int(s) for s in args.sizes.split(',') if s.strip()]
+    selected = [b.strip() for b in args.only.split(',') if b.strip()]
+    unknown = set(selected) - set(ALL_BENCHMARKS)
+    if unknown:
+        parser.error(f"未知的测试项: {', '.join(sorted(unknown))}")
+
+    root = Path(tempfile.mkdtemp(prefix='sd-bench-'))
+    original_cwd = os.getcwd()
+    results = {}
+    try:
+        # 应用使用相对路径 static/...，切换到临时目录以隔离合成数据
+        os.chdir(root)
+        sys.path.insert(0, str(BENCH_DIR))
+        batch_names = []
+        for size in sizes:
+            print(f"生成合成批次: {size} 个艺术家 × {args.prompts} 个提示词")
+            create_synthetic_batch(root, size, args.prompts)
+            batch_names.append(bench_batch_name(size, args.prompts))
+
+        for size, batch_name in zip(sizes, batch_names):
+            url_path = register_bench_batch(batch_name)
+            entry = results.setdefault(f"{size}x{args.prompts}", {})
+            if 'matrix' in selected:
+                print(f"[{batch_name}] get_matrix_data 冷/热缓存")
+                entry['matrix'] = bench_matrix(batch_name, args.repeat)
+            if 'render' in selected:
+                print(f"[{batch_name}] batch.html 渲染")
+                entry['render'] = bench_render(url_path, args.repeat)
+            if 'gunicorn' in selected:
+                print(f"[{batch_name}] gunicorn 并发压测")
+                entry['gunicorn'] = bench_gunicorn(root, batch_names, url_path, args.clients,
+                                                   args.requests, args.workers)
+
+        if 'upload' in selected:
+            print(f"上传吞吐量: {args.upload_images} 张图片")
+            results['upload'] = bench_upload(root, args.upload_images, args.s3_endpoint)
+
+        if 'importtime' in selected:
+            print(f"命令行启动耗时（目标 {STARTUP_TARGET_MS} ms）")
+            batch_path = root / 'static' / 'generate_images' / 'batch' / batch_names[0]
+            results['importtime'] = bench_importtime(batch_path, args.repeat)
+            for name, entry in results['importtime'].items():
+                if entry['over_target']:
+                    print(f"  超出目标: {name} 中位数 {entry['wall']['median_ms']} ms，"
+                          f"最慢导入 {entry['slowest_imports'][0]['module'] if entry['slowest_imports'] else '-'}")
+    finally:
+        os.chdir(original_cwd)
+        shutil.rmtree(root, ignore_errors=True)
+
+    commit = get_git_commit()
+    report = {
+        "timestamp": datetime.now().isoformat(timespec='seconds'),
+        "commit": commit,
+        "python": sys.version.split()[0],
+        "config": {"sizes": sizes, "prompts": args.prompts, "repeat": args.repeat},
+        "results": results
+    }
+
+    if args.output:
+        output_path = Path(args.output)
+    else:
+        RESULTS_DIR.mkdir(parents=True, exist_ok=True)
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        output_path = RESULTS_DIR / f"{stamp}-{commit or 'nocommit'}.json"
+    with open(output_path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\n结果已保存到: {output_path}")
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            previous = json.load(f)
+        regressions = compare_results(previous, report)
+        if regressions:
+            print(f"\n与 {args.compare} 相比发现 {len(regressions)} 项回归：")
+            for item in regressions:
+                print(f"  {item['metric']}: {item['previous']} -> {item['current']} ({item['change']:+}%)")
+            sys.exit(1)
+        print(f"\n与 {args.compare} 相比未发现回归")
+
+
+if __name__ == '__main__':
+    main()
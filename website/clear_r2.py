@@ -1 +1,201 @@
- 
\ No newline at end of file
+"""
+R2 孤立对象清理工具
+
+按批次前缀分页列出存储桶中的对象，与本地的 image_records 和 r2_url_mapping.json
+对比，删除不再被引用的对象。删除使用 delete_objects 每次 1000 个键，并行提交。
+
+示例：
+    python clear_r2.py --dry-run
+    python clear_r2.py --batch 20250102-014551 --yes
+    python clear_r2.py --include-missing-batches --endpoint http://127.0.0.1:5000
+"""
+import argparse
+import json
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from urllib.parse import urlparse
+
+import upload_to_r2
+from upload_to_r2 import R2_CUSTOM_DOMAIN
+
+# S3 delete_objects 单次请求最多 1000 个键
+DELETE_BATCH_SIZE = 1000
+MAX_DELETE_WORKERS = 8
+BATCH_BASE_PATH = Path('static/generate_images/batch')
+
+
+def list_batch_prefixes(s3_client, bucket_name):
+    """列出存储桶中的所有顶层批次前缀"""
+    prefixes = []
+    paginator = s3_client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket_name, Delimiter='/'):
+        for item in page.get('CommonPrefixes', []):
+            prefixes.append(item['Prefix'].rstrip('/'))
+    return prefixes
+
+
+def list_remote_objects(s3_client, bucket_name, batch_name):
+    """分页列出某个批次前缀下的所有对象，返回 {key: size}"""
+    objects = {}
+    paginator = s3_client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket_name, Prefix=f"{batch_name}/"):
+        for item in page.get('Contents', []):
+            objects[item['Key']] = item['Size']
+    return objects
+
+
+def key_from_url(url):
+    """从自定义域名 URL 还原对象键，非本存储桶的 URL 返回 None"""
+    parsed = urlparse(url)
+    if parsed.netloc != R2_CUSTOM_DOMAIN:
+        return None
+    return parsed.path.lstrip('/')
+
+
+def get_expected_keys(batch_path):
+    """根据数据库记录和 URL 映射计算批次仍在引用的对象键"""
+    batch_name = batch_path.name
+    expected = set()
+
+    db_path = batch_path / 'image_generation.db'
+    if db_path.exists():
+        conn = sqlite3.connect(str(db_path))
+        try:
+            for (image_path,) in conn.execute('SELECT image_path FROM image_records'):
+                expected.add(f"{batch_name}/{Path(image_path).name}")
+        finally:
+            conn.close()
+
+    mapping_path = batch_path / 'r2_url_mapping.json'
+    if mapping_path.exists():
+        with open(mapping_path, 'r', encoding='utf-8') as f:
+            for url in json.load(f).values():
+                key = key_from_url(url)
+                if key:
+                    expected.add(key)
+
+    return expected
+
+
+def find_orphans(s3_client, bucket_name, batch_names, include_missing_batches):
+    """对比远端与本地记录，返回 {batch_name: {key: size}}"""
+    orphans = {}
+    for batch_name in batch_names:
+        batch_path = BATCH_BASE_PATH / batch_name
+        has_local_records = (batch_path / 'image_generation.db').exists() or \
+            (batch_path / 'r2_url_mapping.json').exists()
+        if not has_local_records and not include_missing_batches:
+            print(f"跳过本地不存在的批次: {batch_name}（使用 --include-missing-batches 清理）")
+            continue
+
+        remote = list_remote_objects(s3_client, bucket_name, batch_name)
+        expected = get_expected_keys(batch_path) if has_local_records else set()
+        batch_orphans = {key: size for key, size in remote.items() if key not in expected}
+        print(f"{batch_name}: 远端 {len(remote)} 个对象，本地引用 {len(expected)} 个，孤立 {len(batch_orphans)} 个")
+        if batch_orphans:
+            orphans[batch_name] = batch_orphans
+    return orphans
+
+
+def delete_key_batch(s3_client, bucket_name, keys):
+    """删除一批对象（最多 1000 个），返回 (成功数, 失败列表)"""
+    response = s3_client.delete_objects(
+        Bucket=bucket_name,
+        Delete={'Objects': [{'Key': key} for key in keys], 'Quiet': True}
+    )
+    errors = response.get('Errors', [])
+    return len(keys) - len(errors), errors
+
+
+def delete_orphans(s3_client, bucket_name, keys):
+    """把待删除键按 1000 个一组并行删除，返回 (成功数, 失败列表)"""
+    from tqdm import tqdm
+
+    chunks = [keys[i:i + DELETE_BATCH_SIZE] for i in range(0, len(keys), DELETE_BATCH_SIZE)]
+    deleted = 0
+    failures = []
+    max_workers = max(1, min(MAX_DELETE_WORKERS, len(chunks)))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(delete_key_batch, s3_client, bucket_name, chunk) for chunk in chunks]
+        with tqdm(total=len(keys), desc="删除进度") as pbar:
+            for future in as_completed(futures):
+                count, errors = future.result()
+                deleted += count
+                failures.extend(errors)
+                pbar.update(count + len(errors))
+    return deleted, failures
+
+
+def format_bytes(size):
+    """把字节数格式化为易读的字符串"""
+    for unit in ['B', 'KB', 'MB', 'GB']:
+        if size < 1024:
+            return f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} TB"
+
+
+def main():
+    parser = argparse.ArgumentParser(description='清理R2中不再被引用的图片')
+    parser.add_argument('--batch', type=str, help='只处理指定批次，例如：20250102-014551')
+    parser.add_argument('--dry-run', action='store_true', help='只输出报告，不删除任何对象')
+    parser.add_argument('--yes', action='store_true', help='跳过删除前的确认')
+    parser.add_argument('--include-missing-batches', action='store_true',
+                        help='同时清理本地已不存在的批次前缀下的全部对象')
+    parser.add_argument('--endpoint', type=str, help='覆盖R2_ENDPOINT，例如本地S3替身地址')
+    parser.add_argument('--report', type=str, help='把孤立对象清单写入指定JSON文件')
+    args = parser.parse_args()
+
+    if args.endpoint:
+        upload_to_r2.R2_ENDPOINT = args.endpoint
+    if not all([upload_to_r2.R2_ACCESS_KEY_ID, upload_to_r2.R2_SECRET_ACCESS_KEY,
+                upload_to_r2.R2_ENDPOINT, upload_to_r2.R2_BUCKET_NAME]):
+        print("Please set all required environment variables")
+        return
+
+    s3_client, _ = upload_to_r2.init_r2_client()
+    bucket_name = upload_to_r2.R2_BUCKET_NAME
+
+    if args.batch:
+        batch_names = [args.batch]
+    else:
+        batch_names = list_batch_prefixes(s3_client, bucket_name)
+        print(f"存储桶中共有 {len(batch_names)} 个批次前缀")
+
+    orphans = find_orphans(s3_client, bucket_name, batch_names, args.include_missing_batches)
+    keys = [key for batch_orphans in orphans.values() for key in batch_orphans]
+    total_bytes = sum(size for batch_orphans in orphans.values() for size in batch_orphans.values())
+
+    print(f"\n共发现 {len(keys)} 个孤立对象，可回收 {format_bytes(total_bytes)}")
+    for batch_name, batch_orphans in orphans.items():
+        print(f"  {batch_name}: {len(batch_orphans)} 个对象，{format_bytes(sum(batch_orphans.values()))}")
+
+    if args.report:
+        with open(args.report, 'w', encoding='utf-8') as f:
+            json.dump({
+                'total_objects': len(keys),
+                'total_bytes': total_bytes,
+                'batches': orphans
+            }, f, ensure_ascii=False, indent=2)
+        print(f"报告已保存到: {args.report}")
+
+    if args.dry_run or not keys:
+        return
+
+    if not args.yes:
+        confirm = input(f"\n确认删除这 {len(keys)} 个对象吗？(y/N): ")
+        if confirm.strip().lower() != 'y':
+            print("已取消")
+            return
+
+    deleted, failures = delete_orphans(s3_client, bucket_name, keys)
+    print(f"\n成功删除 {deleted} 个对象")
+    if failures:
+        print(f"删除失败 {len(failures)} 个对象：")
+        for error in failures[:20]:
+            print(f"  {error.get('Key')}: {error.get('Code')} {error.get('Message')}")
+
+
+if __name__ == '__main__':
+    main()
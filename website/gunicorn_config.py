@@ -1,4 +1,7 @@
 workers = 4  # 建议设置为CPU核心数量的2-4倍
+# 使用线程worker，实时更新的SSE长连接不会占满所有worker
+worker_class = "gthread"
+threads = 8
 bind = "127.0.0.1:8080"
 timeout = 120
 keepalive = 5
@@ -6,4 +9,16 @@ errorlog = "logs/gunicorn-error.log"
 accesslog = "logs/gunicorn-access.log"
 loglevel = "info"
 # 自定义访问日志格式，使用X-Forwarded-For header获取真实IP
-access_log_format = '%(h)s %({x-forwarded-for}i)s %(l)s %(u)s %(t)s "%(r)s" %(s)s %(b)s "%(f)s" "%(a)s"' 
\ No newline at end of file
+access_log_format = '%(h)s %({x-forwarded-for}i)s %(l)s %(u)s %(t)s "%(r)s" %(s)s %(b)s "%(f)s" "%(a)s"' 
+
+def on_starting(server):
+    """开启请求耗时统计时，/metrics 需要 SD_METRICS_DIR 才能汇总所有 worker 的数据
+    
+    未设置时每次抓取只返回处理该请求的那个 worker 的直方图。启动时清空上次运行留下的指标文件。
+    """
+    import glob
+    import os
+    metrics_dir = os.getenv('SD_METRICS_DIR')
+    if metrics_dir:
+        for path in glob.glob(os.path.join(metrics_dir, '*.json')):
+            os.remove(path)
@@ -0,0 +1,278 @@
+"""
+请求级耗时统计与采样分析（默认关闭）
+
+通过环境变量开启：
+- SD_REQUEST_TIMING=1            记录各阶段耗时，输出 Server-Timing 头并开放 /metrics
+- SD_PROFILE_THRESHOLD_MS=500    请求总耗时超过该阈值时保存分析结果
+- SD_PROFILE_SAMPLE_RATE=0.1     参与分析的请求比例，0 表示不做分析
+- SD_PROFILER=cprofile           分析器，可选 cprofile / pyinstrument
+- SD_PROFILE_DIR=logs/profiles   分析结果保存目录
+- SD_METRICS_DIR=logs/metrics    多进程共享指标的目录；gunicorn 多个 worker 时必须设置，
+                                 否则每次抓取 /metrics 只能看到恰好处理该请求的 worker 的数据
+
+每个时间序列都带有 worker（进程号）标签。设置 SD_METRICS_DIR 后各 worker 定期把自己的直方图
+写入该目录，/metrics 合并输出所有 worker 的数据，可在 Prometheus 中按 route 求和。
+"""
+import json
+import os
+import random
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+from flask import Response, g, has_request_context, request
+
+TIMING_ENABLED = os.getenv('SD_REQUEST_TIMING', '0') == '1'
+PROFILE_THRESHOLD_MS = float(os.getenv('SD_PROFILE_THRESHOLD_MS', '500'))
+PROFILE_SAMPLE_RATE = float(os.getenv('SD_PROFILE_SAMPLE_RATE', '0'))
+PROFILER = os.getenv('SD_PROFILER', 'cprofile')
+PROFILE_DIR = Path(os.getenv('SD_PROFILE_DIR', 'logs/profiles'))
+METRICS_DIR = Path(os.environ['SD_METRICS_DIR']) if os.getenv('SD_METRICS_DIR') else None
+METRICS_FLUSH_INTERVAL = 1.0  # worker 写出共享指标的最短间隔（秒）
+
+# 直方图分桶上界（秒）与响应大小分桶上界（字节）
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (1024, 10 * 1024, 100 * 1024, 1024 * 1024, 10 * 1024 * 1024, 100 * 1024 * 1024)
+
+
+class Histogram:
+    """按路由累计的直方图（线程安全，进程内）"""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def observe(self, labels, value):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = {'counts': [0] * (len(self.buckets) + 1), 'sum': 0.0, 'count': 0}
+            series['counts'][bisect_left(self.buckets, value)] += 1
+            series['sum'] += value
+            series['count'] += 1
+
+    def snapshot(self):
+        """返回当前进程的所有序列 [(labels, counts, sum, count)]，标签中加上 worker 进程号"""
+        worker = (('worker', str(os.getpid())),)
+        with self._lock:
+            return [[list(labels + worker), list(series['counts']), series['sum'], series['count']]
+                    for labels, series in self._series.items()]
+
+    def render(self, name, help_text, rows):
+        """把 snapshot() 得到的序列输出为 Prometheus 文本格式"""
+        lines = [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+        for labels, counts, total, count in sorted(rows):
+            label_text = ','.join(f'{k}="{v}"' for k, v in labels)
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f'{name}_bucket{{{label_text},le="{bound}"}} {cumulative}')
+            lines.append(f'{name}_bucket{{{label_text},le="+Inf"}} {count}')
+            lines.append(f'{name}_sum{{{label_text}}} {total:.6f}')
+            lines.append(f'{name}_count{{{label_text}}} {count}')
+        return lines
+
+
+request_latency = Histogram(LATENCY_BUCKETS)
+stage_latency = Histogram(LATENCY_BUCKETS)
+response_size = Histogram(SIZE_BUCKETS)
+METRICS = (
+    ('sd_request_duration_seconds', '请求总耗时', request_latency),
+    ('sd_request_stage_duration_seconds', '请求各阶段耗时', stage_latency),
+    ('sd_response_size_bytes', '响应体大小', response_size),
+)
+
+_flush_lock = threading.Lock()
+_last_flush = 0.0
+
+
+def flush_metrics(force=False):
+    """把本进程的直方图写入共享目录（未设置 SD_METRICS_DIR 时不做任何事）"""
+    global _last_flush
+    if METRICS_DIR is None:
+        return
+    with _flush_lock:
+        now = time.monotonic()
+        if not force and now - _last_flush < METRICS_FLUSH_INTERVAL:
+            return
+        _last_flush = now
+        data = {name: histogram.snapshot() for name, _, histogram in METRICS}
+        METRICS_DIR.mkdir(parents=True, exist_ok=True)
+        target = METRICS_DIR / f"{os.getpid()}.json"
+        # 先写临时文件再替换，/metrics 不会读到写了一半的文件
+        temp = target.with_suffix('.tmp')
+        temp.write_text(json.dumps(data), encoding='utf-8')
+        os.replace(temp, target)
+
+
+def collect_metrics():
+    """收集所有 worker 的序列；未设置共享目录时只有当前进程"""
+    if METRICS_DIR is None:
+        return {name: histogram.snapshot() for name, _, histogram in METRICS}
+    flush_metrics(force=True)
+    merged = {name: [] for name, _, _ in METRICS}
+    # 已退出的 worker 的文件保留，保证计数只增不减
+    for path in METRICS_DIR.glob('*.json'):
+        try:
+            data = json.loads(path.read_text(encoding='utf-8'))
+        except (OSError, ValueError):
+            continue
+        for name in merged:
+            merged[name] += [[tuple(map(tuple, row[0])), *row[1:]] for row in data.get(name, [])]
+    return merged
+
+
+@contextmanager
+def stage(name):
+    """记录当前请求中某个阶段的耗时，未开启或不在请求上下文中时不做任何事"""
+    if not TIMING_ENABLED or not has_request_context():
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        g.setdefault('stage_timings', []).append((name, time.perf_counter() - start))
+
+
+def stream_stage(name, chunks):
+    """记录流式响应体从开始生成到结束（或客户端断开）的耗时
+
+    需在请求上下文中调用；响应头此时已发送，结果只进入 /metrics 的直方图。
+    """
+    if not TIMING_ENABLED or not has_request_context():
+        return chunks
+    timings = g.setdefault('stage_timings', [])
+
+    def timed():
+        start = time.perf_counter()
+        try:
+            yield from chunks
+        finally:
+            timings.append((name, time.perf_counter() - start))
+    return timed()
+
+
+def _route_label():
+    """用路由规则而不是具体 URL 作为标签，避免标签数量无限增长"""
+    rule = request.url_rule
+    return rule.rule if rule is not None else 'unmatched'
+
+
+def _start_profiler():
+    if PROFILER == 'pyinstrument':
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            return None
+        profiler = Profiler()
+        profiler.start()
+        return profiler
+    import cProfile
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # 同一线程已有其他分析器在运行
+        return None
+    return profiler
+
+
+def _stop_profiler(profiler, elapsed):
+    """停止分析器，总耗时超过阈值时保存结果"""
+    if PROFILER == 'pyinstrument':
+        profiler.stop()
+    else:
+        profiler.disable()
+    if elapsed * 1000 < PROFILE_THRESHOLD_MS:
+        return
+    PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+    route = _route_label().strip('/').replace('/', '_').replace('<', '').replace('>', '') or 'root'
+    stamp = datetime.now().strftime('%Y%m%d-%H%M%S-%f')
+    base = PROFILE_DIR / f"{stamp}-{route}-{int(elapsed * 1000)}ms"
+    if PROFILER == 'pyinstrument':
+        base.with_suffix('.html').write_text(profiler.output_html(), encoding='utf-8')
+    else:
+        profiler.dump_stats(str(base.with_suffix('.prof')))
+
+
+def _observe_stream(body, route, timings, start_index):
+    """包装流式响应体：边发送边统计大小，发送结束（或客户端断开）后记录大小和发送期间完成的阶段"""
+    size = 0
+    try:
+        for chunk in body:
+            if isinstance(chunk, str):
+                chunk = chunk.encode('utf-8')
+            size += len(chunk)
+            yield chunk
+    finally:
+        # 先关闭内层生成器，让其中尚未结束的阶段完成记录
+        close = getattr(body, 'close', None)
+        if close is not None:
+            close()
+        response_size.observe((('route', route),), size)
+        for name, duration in timings[start_index:]:
+            stage_latency.observe((('route', route), ('stage', name)), duration)
+        flush_metrics()
+
+
+def init_app(app):
+    """在 Flask 应用上注册耗时统计钩子与 /metrics 路由"""
+    if not TIMING_ENABLED:
+        return
+
+    @app.before_request
+    def start_timer():
+        g.request_start = time.perf_counter()
+        g.profiler = None
+        if PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE:
+            g.profiler = _start_profiler()
+
+    @app.after_request
+    def record_timing(response):
+        start = g.get('request_start')
+        if start is None:
+            return response
+        elapsed = time.perf_counter() - start
+        route = _route_label()
+
+        # 流式响应发送期间完成的阶段也会追加到同一个列表中
+        timings = g.setdefault('stage_timings', [])
+        recorded = len(timings)
+        entries = [f'{name};dur={duration * 1000:.2f}' for name, duration in timings]
+        entries.append(f'total;dur={elapsed * 1000:.2f}')
+        if response.is_streamed:
+            # 不能调用 calculate_content_length()，它会把整个生成器读进内存；
+            # 长度未知时包装响应体，在发送结束后记录大小，对应耗时只进入直方图
+            size = response.content_length
+            if size is None:
+                response.response = _observe_stream(response.response, route, timings, recorded)
+        else:
+            size = response.calculate_content_length()
+        if size is not None:
+            entries.append(f'size;desc="{size} bytes"')
+            response_size.observe((('route', route),), size)
+        response.headers['Server-Timing'] = ', '.join(entries)
+
+        request_latency.observe((('route', route), ('status', str(response.status_code))), elapsed)
+        for name, duration in timings:
+            stage_latency.observe((('route', route), ('stage', name)), duration)
+        flush_metrics()
+
+        profiler = g.pop('profiler', None)
+        if profiler is not None:
+            _stop_profiler(profiler, elapsed)
+        return response
+
+    @app.route('/metrics')
+    def metrics():
+        """延迟直方图；未设置 SD_METRICS_DIR 时只包含处理本次请求的 worker 的数据"""
+        collected = collect_metrics()
+        lines = []
+        for name, help_text, histogram in METRICS:
+            lines += histogram.render(name, help_text, collected[name])
+        return Response('\n'.join(lines) + '\n', mimetype='text/plain; version=0.0.4')
@@ -175,4 +175,111 @@ function jumpToRow() {
         // 延迟一下再开始观察图片，等待页面稳定
         setTimeout(observeVisibleImages, 100);
     }
-}
\ No newline at end of file
+}
+
+// 生成中批次的实时更新：通过SSE接收新单元格并修补表格
+const PLACEHOLDER_GIF = 'data:image/gif;base64,R0lGODlhAQABAIAAAAAAAP///yH5BAEAAAAALAAAAAABAAEAAAIBRAA7';
+const observeVisibleImagesLater = debounce(observeVisibleImages, 200);
+
+function initLiveUpdates(eventsUrl, lastEventId, thumbnailWidth) {
+    const table = document.querySelector('.matrix-table');
+    if (!table || !window.EventSource) return;
+
+    // 事件id形如 "<generation>:<rowid>"，断线重连时浏览器会自动带上Last-Event-ID
+    const source = new EventSource(`${eventsUrl}?after=${encodeURIComponent(lastEventId)}`);
+    source.addEventListener('cell', (event) => {
+        const cell = JSON.parse(event.data);
+        updateMatrixCell(table, cell.artist, cell.prompt, cell.url, thumbnailWidth);
+    });
+    // 批次被重新生成时服务器要求重新加载整个页面
+    source.addEventListener('reload', () => {
+        source.close();
+        window.location.reload();
+    });
+}
+
+// 获取提示词所在的列，不存在时在表头和每一行末尾新增一列
+function getPromptColumn(table, prompt) {
+    const headerRow = table.querySelector('thead tr');
+    const headers = Array.from(headerRow.children);
+    const index = headers.findIndex(th => th.dataset.prompt === prompt);
+    if (index !== -1) return index;
+
+    const th = document.createElement('th');
+    th.className = 'prompt-header';
+    th.dataset.prompt = prompt;
+    th.textContent = prompt;
+    headerRow.appendChild(th);
+    table.querySelectorAll('tbody tr').forEach(row => row.appendChild(createEmptyCell()));
+    return headers.length;
+}
+
+// 获取艺术家所在的行，不存在时在表格末尾新增一行
+function getArtistRow(table, artist) {
+    const tbody = table.querySelector('tbody');
+    const existing = Array.from(tbody.children).find(row => row.dataset.artist === artist);
+    if (existing) return existing;
+
+    const rowNumber = tbody.children.length + 1;
+    const row = document.createElement('tr');
+    row.id = `row-${rowNumber}`;
+    row.dataset.artist = artist;
+
+    const th = document.createElement('th');
+    th.className = 'artist-header';
+    const indicator = document.createElement('span');
+    indicator.className = 'row-number-indicator';
+    indicator.textContent = rowNumber;
+    th.appendChild(indicator);
+    th.appendChild(document.createTextNode(` ${artist}`));
+    row.appendChild(th);
+
+    const columnCount = table.querySelector('thead tr').children.length;
+    for (let i = 1; i < columnCount; i++) {
+        row.appendChild(createEmptyCell());
+    }
+    tbody.appendChild(row);
+
+    const rowInput = document.getElementById('rowNumber');
+    if (rowInput) rowInput.max = rowNumber;
+    return row;
+}
+
+function createEmptyCell() {
+    const td = document.createElement('td');
+    td.className = 'image-cell';
+    const empty = document.createElement('div');
+    empty.className = 'no-image';
+    empty.textContent = '无图片';
+    td.appendChild(empty);
+    return td;
+}
+
+function updateMatrixCell(table, artist, prompt, url, thumbnailWidth) {
+    if (!url) return;
+    const column = getPromptColumn(table, prompt);
+    const row = getArtistRow(table, artist);
+    const td = row.children[column];
+    if (!td) return;
+
+    const container = document.createElement('div');
+    container.className = 'image-container';
+    const img = document.createElement('img');
+    img.src = PLACEHOLDER_GIF;
+    // 本地图片在表格中使用缩略图，模态框中显示原图
+    if (url.startsWith('/') && thumbnailWidth) {
+        img.dataset.src = `${url}?w=${thumbnailWidth}`;
+        img.dataset.full = url;
+    } else {
+        img.dataset.src = url;
+    }
+    img.alt = `${artist} - ${prompt}`;
+    img.className = 'matrix-image';
+    img.dataset.bsToggle = 'modal';
+    img.dataset.bsTarget = '#imageModal';
+    img.addEventListener('click', () => showImage(img.dataset.full || img.dataset.src || img.src, artist, prompt));
+    container.appendChild(img);
+
+    td.replaceChildren(container);
+    observeVisibleImagesLater();
+}
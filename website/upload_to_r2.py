@@ -1,12 +1,10 @@
 import os
-import boto3
 from pathlib import Path
 import mimetypes
 import sqlite3
 import json
 import argparse
 from concurrent.futures import ThreadPoolExecutor, as_completed
-from tqdm import tqdm  # 添加进度条支持
 
 # Cloudflare R2配置
 R2_ACCESS_KEY_ID = os.getenv('R2_ACCESS_KEY_ID')
@@ -23,6 +21,8 @@ def init_r2_client():
     """初始化 R2 客户端和 bucket"""
     global s3_client, r2_bucket
     if s3_client is None:
+        # boto3 导入较慢，只在真正访问 R2 时才导入，--help 等命令不受影响
+        import boto3
         s3_client = boto3.client(
             's3',
             endpoint_url=R2_ENDPOINT,
@@ -56,20 +56,72 @@ def upload_file_to_r2(file_path, bucket, key):
         print(f"Error uploading {file_path}: {e}")
         return None
 
+def copy_object_in_r2(bucket, source_key, key):
+    """在R2内部复制已有对象并返回URL，不经过本机传输图片数据"""
+    try:
+        bucket.copy({'Bucket': bucket.name, 'Key': source_key}, key)
+        return f"https://{R2_CUSTOM_DOMAIN}/{key}"
+    except Exception as e:
+        print(f"Error copying {source_key}: {e}")
+        return None
+
 def upload_single_image(args):
     """单个图片上传函数，用于多线程处理"""
-    full_path, batch_name, r2_bucket = args
+    full_path, batch_name, r2_bucket, source_key = args
     # 使用原始路径作为键
     image_path = str(full_path.name)  # 只使用文件名
     r2_key = f"{batch_name}/{image_path}"
     
-    r2_url = upload_file_to_r2(str(full_path), r2_bucket, r2_key)
+    r2_url = None
+    if source_key:
+        # 来自生成缓存的图片优先在R2内复制，失败时再上传本地文件
+        r2_url = copy_object_in_r2(r2_bucket, source_key, r2_key)
+    if not r2_url:
+        r2_url = upload_file_to_r2(str(full_path), r2_bucket, r2_key)
     if r2_url:
         return image_path, r2_url
     return None
 
-def process_batch(batch_path):
+def get_duplicate_mapping(cursor, skip_duplicates):
+    """读取 image_dedup 写入的重复关系，返回 {重复图片: 保留的原图}
+
+    skip_duplicates 为 'exact' 时只跳过完全相同的图片，为 'near' 时同时跳过近似重复的图片。
+    """
+    if skip_duplicates == 'none':
+        return {}
+    cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='image_duplicates'")
+    if cursor.fetchone() is None:
+        print("数据库中没有重复检测结果，请先运行 image_dedup.py")
+        return {}
+    kinds = ('exact',) if skip_duplicates == 'exact' else ('exact', 'near')
+    cursor.execute('SELECT image_path, duplicate_of FROM image_duplicates WHERE kind IN ({})'.format(
+        ','.join('?' * len(kinds))), kinds)
+    return {Path(image_path).name: Path(duplicate_of).name for image_path, duplicate_of in cursor.fetchall()}
+
+def get_cache_copy_sources(cursor, batch_path):
+    """读取生成缓存的复用记录，返回 {图片: 源批次中已上传的R2键}"""
+    cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='cache_hits'")
+    if cursor.fetchone() is None:
+        return {}
+    cursor.execute('SELECT image_path, source_batch, source_image FROM cache_hits')
+    source_mappings = {}
+    copy_sources = {}
+    for image_path, source_batch, source_image in cursor.fetchall():
+        if source_batch not in source_mappings:
+            mapping_file = batch_path.parent / source_batch / 'r2_url_mapping.json'
+            source_mappings[source_batch] = {}
+            if mapping_file.exists():
+                with open(mapping_file, 'r', encoding='utf-8') as f:
+                    source_mappings[source_batch] = json.load(f)
+        # 只有源图片确实已上传时才能在R2内复制
+        if Path(source_image).name in source_mappings[source_batch]:
+            copy_sources[Path(image_path).name] = f"{source_batch}/{Path(source_image).name}"
+    return copy_sources
+
+def process_batch(batch_path, skip_duplicates='none'):
     """处理单个批次的图片上传"""
+    from tqdm import tqdm  # 添加进度条支持
+
     global s3_client, r2_bucket
     if s3_client is None or r2_bucket is None:
         s3_client, r2_bucket = init_r2_client()
@@ -92,7 +144,16 @@ def process_batch(batch_path):
         conn.close()
         return
     
-    print(f"\n开始上传 {len(image_paths)} 张图片...")
+    # 重复的图片不再上传，直接复用原图的URL
+    duplicates = get_duplicate_mapping(cursor, skip_duplicates)
+    if duplicates:
+        print(f"跳过 {len(duplicates)} 张重复图片")
+    
+    copy_sources = get_cache_copy_sources(cursor, batch_path)
+    if copy_sources:
+        print(f"{len(copy_sources)} 张来自生成缓存的图片将在R2内复制")
+    
+    print(f"\n开始上传 {len(image_paths) - len(duplicates)} 张图片...")
     
     # 创建URL映射文件
     url_mapping = {}
@@ -100,14 +161,16 @@ def process_batch(batch_path):
     # 准备上传任务
     upload_tasks = []
     for (image_path,) in image_paths:
+        if Path(image_path).name in duplicates:
+            continue
         full_path = batch_path / image_path
         if not full_path.exists():
             print(f"Image not found: {full_path}")
             continue
-        upload_tasks.append((full_path, batch_path.name, r2_bucket))
+        upload_tasks.append((full_path, batch_path.name, r2_bucket, copy_sources.get(full_path.name)))
     
     # 使用线程池并行上传
-    max_workers = min(32, len(upload_tasks))  # 最多32个线程
+    max_workers = max(1, min(32, len(upload_tasks)))  # 最多32个线程
     with ThreadPoolExecutor(max_workers=max_workers) as executor:
         # 提交所有任务并使用tqdm显示进度
         futures = [executor.submit(upload_single_image, task) for task in upload_tasks]
@@ -120,6 +183,13 @@ def process_batch(batch_path):
                     url_mapping[image_path] = r2_url
                 pbar.update(1)
     
+    for image_path, duplicate_of in duplicates.items():
+        # 完全重复可能指向一张本身被判定为近似重复的图片，沿关系找到实际上传的原图
+        while duplicate_of in duplicates:
+            duplicate_of = duplicates[duplicate_of]
+        if duplicate_of in url_mapping:
+            url_mapping[image_path] = url_mapping[duplicate_of]
+    
     # 保存URL映射
     if url_mapping:
         mapping_file = batch_path / 'r2_url_mapping.json'
@@ -136,6 +206,8 @@ def main():
     # 创建命令行参数解析器
     parser = argparse.ArgumentParser(description='上传图片到R2存储')
     parser.add_argument('--batch', type=str, help='指定要上传的批次名称，例如：20250102-014551')
+    parser.add_argument('--skip-duplicates', choices=['none', 'exact', 'near'], default='none',
+                        help='跳过image_dedup.py检测出的重复图片：exact只跳过完全相同的，near同时跳过近似重复的')
     args = parser.parse_args()
 
     if not all([R2_ACCESS_KEY_ID, R2_SECRET_ACCESS_KEY, R2_ENDPOINT, R2_BUCKET_NAME]):
@@ -158,14 +230,14 @@ def main():
             print(f"指定的批次不存在: {batch_path}")
             return
         print(f"\nProcessing specified batch: {batch_path}")
-        process_batch(batch_path)
+        process_batch(batch_path, args.skip_duplicates)
     else:
         # 处理所有批次
         print("\n未指定批次，将处理所有批次")
         for batch_path in base_path.iterdir():
             if batch_path.is_dir():
                 print(f"\nProcessing batch: {batch_path}")
-                process_batch(batch_path)
+                process_batch(batch_path, args.skip_duplicates)
 
 if __name__ == '__main__':
     main() 
\ No newline at end of file
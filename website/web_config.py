@@ -5,6 +5,7 @@
 # 批次显示配置
 # key: 原始批次路径
 # value: 字典，包含显示名称(display_name)和自定义URL(url_path)
+# 生成中的批次可以设置 "live": True，页面会通过SSE实时显示新生成的图片
 BATCH_DISPLAY_CONFIG = {
     "batch/20250102-014551": {
         "display_name": "NoobAI-XL V-Pred 1.0 Version 画风对比",
@@ -16,6 +17,20 @@ BATCH_DISPLAY_CONFIG = {
     # 可以添加更多批次配置
 }
 
+# 是否允许通过 /live/<批次名> 实时查看任意生成中的批次（包括未加入上面配置或未启用的批次）
+# 默认关闭，只有配置了 "live": True 的批次可以实时查看
+LIVE_BATCHES_ENABLED = False
+
+# 本地图片服务配置
+LOCAL_IMAGE_FALLBACK = True  # R2映射中缺少的图片回退到本地文件（表格中显示缩略图）
+THUMBNAIL_WIDTH = 384  # 本地回退图片在表格中使用的缩略图宽度
+DERIVATIVE_WIDTHS = (256, 384, 512, 768)  # 允许通过 ?w= 请求的缩略图宽度
+# 交给前端服务器发送图片，gunicorn worker不再传输图片数据：
+# None 由Flask直接发送；"x-sendfile" 适用于Apache/lighttpd；"x-accel" 适用于nginx，需要配置：
+#   location /internal-images/ { internal; alias /path/to/website/static/; }
+IMAGE_OFFLOAD = None
+X_ACCEL_PREFIX = "/internal-images"
+
 def get_batch_config(batch_path):
     """获取批次的显示配置"""
     return BATCH_DISPLAY_CONFIG.get(batch_path, {